@@ -1,4 +1,5 @@
-from hermes.exchanges.ndax import create_request, NDAXSession
+from hermes.exchanges.ndax import NDAXSession
+from hermes.utils.ratelimit import PRIORITY_ACCOUNT
 from collections import defaultdict
 import logging
 
@@ -10,9 +11,16 @@ class NDAXAccount:
         self.positions = defaultdict(float)
         self.logger = logging.getLogger(self.__class__.__name__)
 
+    def register_handlers(self, router):
+        router.register("GetAccountPositions", self.process_account_positions)
+
     async def request_account_update(self):
-        req = create_request(0, 'GetAccountPositions',{'OMSId': 1, 'AccountId': self.account_id})
-        await self.session.send(req)
+        # Returns once the reply has been processed into self.positions
+        await self.session.request(
+            "GetAccountPositions",
+            {"OMSId": 1, "AccountId": self.account_id},
+            priority=PRIORITY_ACCOUNT,
+        )
 
     async def process_account_positions(self, account_position_payload):
         for entry in account_position_payload:
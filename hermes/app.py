@@ -1,17 +1,20 @@
 from hermes.exchanges.ndax import (
     NDAXSession,
-    create_subscribe_level2_req,
     BTCCAD_ID,
     BTCUSDT_ID,
     USDTCAD_ID,
+    INSTRUMENT_SPECS,
+    MFAError,
+    RequestError,
 )
 from hermes.orderbook.orderbook import NDAXOrderbook
 from hermes.strategies.arbitrage.triangle import TriangleBTCUSDTL1
 from hermes.trader.trader import NDAXMarketTriangleTrader
-from hermes.exchanges.ndax import create_request
 from hermes.account.ndax import NDAXAccount
 from hermes.router.router import NDAXRouter
 from hermes.utils.synchronization import SingletonTradeLock, SingletonResetEvent, SingletonExitEvent
+from hermes.utils.ratelimit import PRIORITY_SUBSCRIPTION
+from hermes.utils.latency import LatencyTracer
 import traceback
 
 import asyncio
@@ -19,12 +22,23 @@ import json
 import logging
 import traceback
 import sys
+from itertools import count
+from time import perf_counter_ns
 
 logging.basicConfig()
 
 
 # TODO: Create config file for this stuff
 BOOK_DEPTH = 10
+BOOK_BACKEND = "array"
+INGEST_QUEUE_SIZE = 10000
+INGEST_LAG_WARNING_MS = 500
+LATENCY_TRACING = False
+
+# Ingest queue priorities. Order entry frames (acks, fills, account events)
+# are processed ahead of any market data that arrived in the same batch.
+ORDER_ENTRY_FRAMES = 0
+MARKET_DATA_FRAMES = 1
 
 
 
@@ -36,7 +50,10 @@ class NDAXBot:
         self.logger = logging.getLogger(self.__class__.__name__)
         self.session = NDAXSession(user_id, api_key, secret)
         self.orderbook = NDAXOrderbook(
-            instrument_keys=(BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID), depth=BOOK_DEPTH
+            instrument_keys=(BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID),
+            depth=BOOK_DEPTH,
+            backend=BOOK_BACKEND,
+            instrument_specs=INSTRUMENT_SPECS,
         )
         self.orderbook_print_interval = orderbook_print_interval
 
@@ -59,6 +76,10 @@ class NDAXBot:
         self.event_loop = asyncio.get_event_loop()
         self.trade_lock = SingletonTradeLock.instance(self.event_loop)
         self.reset_trigger = SingletonResetEvent.instance(self.event_loop)
+        # Set once the account and subscriptions of the current session are live
+        self.ready = asyncio.Event()
+        self.tracer = LatencyTracer.instance()
+        self.tracer.enabled = LATENCY_TRACING
 
 
     def start(self):
@@ -84,7 +105,10 @@ class NDAXBot:
             task.cancel()
 
     async def main_loop(self):
-        # Initialize session first
+        # A second session is kept connected and authenticated, so a reset
+        # swaps connections instead of starting with a full handshake.
+        self.standby_enabled = True
+        self.standby = asyncio.ensure_future(self.prepare_standby())
         while True:
             tasks = self.collect_bot_tasks()
             tasks.append(self.reset_trigger.wait())
@@ -104,28 +128,151 @@ class NDAXBot:
                 self.logger.warning("RESET REQUESTED: Restarting Tasks")
                 for task in pending:
                     task.cancel()
-
-            self.orderbook.clear()
+                # Let bot_loop close the old connections before swapping
+                await asyncio.gather(*pending, return_exceptions=True)
+                # The new session subscribes to every book from scratch
+                self.router.cancel_resubscriptions()
+
+            # Books survive a failover: the resubscribe snapshots replace them,
+            # and any sequence gap in between invalidates the affected book.
+            if not self.failover():
+                self.orderbook.clear()
             self.trader.reset()
 
             self.reset_trigger.clear()
 
+    async def prepare_standby(self):
+        standby = self.session.create_standby()
+        try:
+            # Never prompt for a 2FA code from the background
+            await standby.connect(interactive=False)
+        except MFAError:
+            await standby.close()
+            self.logger.warning("Account requires 2FA, standby sessions disabled")
+            self.standby_enabled = False
+            return None
+        except Exception:
+            await standby.close()
+            raise
+        self.logger.info("Standby session ready")
+        return standby
+
+    def failover(self):
+        """failover.
+        Swap the standby's connections into the session and start warming up
+        the next standby.
+
+        :returns: False if no standby was ready, and the bot will start cold
+        """
+        standby = self.standby
+        self.standby = (
+            asyncio.ensure_future(self.prepare_standby())
+            if self.standby_enabled
+            else None
+        )
+        if standby is None:
+            return False
+        if not standby.done():
+            standby.cancel()
+            self.logger.warning("Standby session not ready, reconnecting cold")
+            return False
+        if standby.cancelled() or standby.exception() is not None:
+            self.logger.warning("Standby session failed, reconnecting cold")
+            return False
+        if standby.result() is None:  # Disabled, already logged
+            return False
+        if not standby.result().connected:
+            self.logger.warning("Standby session dropped, reconnecting cold")
+            return False
+
+        self.session.adopt(standby.result())
+        self.logger.warning("Failed over to standby session")
+        return True
+
     async def bot_loop(self):
-        await self.session.initialize_session()
+        self.ready.clear()
         try:
-            await self.session.authenticate()
-            await self.account.request_account_update()
-
-            sub_requests = self.get_sub_requests()
-            for request in sub_requests:
-                await self.session.send(request)
-            async for message in self.session.session:
-                await self.router.route(message)
+            if not self.session.connected:  # Unless a standby was swapped in
+                await self.session.connect()
+
+            # Each connection has its own reader task, and processing runs
+            # separately, so a slow batch never holds up a socket read. They
+            # have to be running before startup, which awaits replies.
+            self.ingest_queue = asyncio.PriorityQueue(maxsize=INGEST_QUEUE_SIZE)
+            self.ingest_sequence = count()
+            readers = {
+                asyncio.ensure_future(
+                    self.receive_loop(self.session.session, ORDER_ENTRY_FRAMES)
+                ),
+                asyncio.ensure_future(
+                    self.receive_loop(self.session.market_data, MARKET_DATA_FRAMES)
+                ),
+                asyncio.ensure_future(self.process_loop()),
+            }
+            startup = asyncio.ensure_future(self.start_session())
+            try:
+                done, _ = await asyncio.wait(
+                    readers | {startup}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if startup in done:
+                    startup.result()
+                    done, _ = await asyncio.wait(
+                        readers, return_when=asyncio.FIRST_COMPLETED
+                    )
+            finally:
+                for task in readers | {startup}:
+                    task.cancel()
+            for task in done:
+                task.result()  # Surface the exception, if any
         except asyncio.CancelledError:
             self.logger.error("Cancelled")
         finally:
             await self.session.close()
 
+    async def start_session(self):
+        # Each reply is awaited, so the account is loaded and the books hold
+        # their snapshots by the time the session is marked ready.
+        await asyncio.gather(
+            self.account.request_account_update(),
+            *(
+                self.session.request(
+                    fn, payload, priority=PRIORITY_SUBSCRIPTION, market_data=market_data
+                )
+                for fn, payload, market_data in self.get_subscriptions()
+            )
+        )
+        self.ready.set()
+        self.logger.info("Session ready")
+
+    async def receive_loop(self, connection, priority):
+        # The sequence breaks timestamp ties, so frames are never compared
+        async for message in connection:
+            await self.ingest_queue.put(
+                (priority, perf_counter_ns(), next(self.ingest_sequence), message)
+            )
+
+    async def process_loop(self):
+        queue = self.ingest_queue
+        tracer = self.tracer
+        while True:
+            _, oldest_ns, _, message = await queue.get()
+            batch = [message]
+            while not queue.empty():
+                _, received_ns, _, message = queue.get_nowait()
+                batch.append(message)
+                oldest_ns = min(oldest_ns, received_ns)
+            if tracer.enabled:
+                tracer.begin(oldest_ns)
+
+            lag_ms = (perf_counter_ns() - oldest_ns) / 1e6
+            if lag_ms > INGEST_LAG_WARNING_MS:
+                self.logger.warning(
+                    f"Ingest lagging: {len(batch)} frames, oldest {lag_ms:.0f}ms old"
+                )
+
+            # Apply every update in the batch, then evaluate strategies once
+            await self.router.route_batch(batch)
+
     async def autoreset(
         self, autoreset_timer=30
     ):  # Automatically resyncs every minutes, just in case
@@ -141,19 +288,25 @@ class NDAXBot:
             # Don't print while there's an ongoing trade
             async with self.trade_lock:
                 self.orderbook.print_orderbook()
+                self.router.log_handler_stats()
+                if self.tracer.enabled:
+                    self.tracer.log_report()
                 print("------------------------")
 
     async def net_asset_change_loop(self, update_time=30):  # 30 minutes
-        await asyncio.sleep(10)  # Wait for other stuff to initialize
+        await self.ready.wait()
         current_assets = {k: v for k, v in self.account.positions.items()}
         self.logger.info(f"Current Assets: {current_assets}")
         while (
             True
         ):  # TODO Chances are low, but this could interfere with trades. It is probably best to schedule this more intelligently
-            await self.account.request_account_update()
-            await asyncio.sleep(
-                10
-            )  # TODO: This is bad design. Should use a condition or something.
+            try:
+                await self.account.request_account_update()
+            except (asyncio.TimeoutError, RequestError) as e:
+                # A lost reply is not worth a reset, try again next cycle
+                self.logger.warning(f"Account update failed, retrying later: {e!r}")
+                await asyncio.sleep(update_time * 60)
+                continue
 
             async with self.trade_lock:
                 new_assets = {k: v for k, v in self.account.positions.items()}
@@ -166,17 +319,24 @@ class NDAXBot:
 
             await asyncio.sleep(update_time * 60)
 
-    def get_sub_requests(self):
-        req1 = create_subscribe_level2_req(BTCCAD_ID, depth=BOOK_DEPTH)
-        req2 = create_subscribe_level2_req(BTCUSDT_ID, depth=BOOK_DEPTH)
-        req3 = create_subscribe_level2_req(USDTCAD_ID, depth=BOOK_DEPTH)
-        req4 = create_request(
-            0,
-            "SubscribeAccountEvents",
-            {"OMSId": 1, "AccountId": self.account.account_id},
+    def get_subscriptions(self):
+        subscriptions = [
+            (
+                "SubscribeLevel2",
+                {"OMSId": 1, "InstrumentId": _id, "Depth": BOOK_DEPTH},
+                True,
+            )
+            for _id in (BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID)
+        ]
+        # Account events need the authenticated connection
+        subscriptions.append(
+            (
+                "SubscribeAccountEvents",
+                {"OMSId": 1, "AccountId": self.account.account_id},
+                False,
+            )
         )
-
-        return req1, req2, req3, req4
+        return subscriptions
 
 
 if __name__ == "__main__":
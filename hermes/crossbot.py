@@ -0,0 +1,127 @@
+from hermes.exchanges.ndax import (
+    NDAX_URL,
+    BTCCAD_ID,
+    INSTRUMENT_SPECS as NDAX_INSTRUMENT_SPECS,
+    FEE as NDAX_FEE,
+    create_subscribe_level2_req,
+)
+from hermes.exchanges.kraken import (
+    DEMO_URL as KRAKEN_URL,
+    INSTRUMENT_SPECS as KRAKEN_INSTRUMENT_SPECS,
+    FEE as KRAKEN_FEE,
+    KrakenOrderBook,
+)
+from hermes.orderbook.orderbook import NDAXOrderbook
+from hermes.router.router import NDAXMarketDataRouter, KrakenRouter
+from hermes.strategies.arbitrage.cross import CrossVenueArbitrage
+
+import asyncio
+import json
+import logging
+import websockets
+
+logging.basicConfig(level=logging.INFO)
+
+VENUE_NDAX = "ndax"
+VENUE_KRAKEN = "kraken"
+
+# Same instrument on each venue
+CROSS_INSTRUMENTS = {VENUE_NDAX: BTCCAD_ID, VENUE_KRAKEN: "XBT/CAD"}
+FEES = {VENUE_NDAX: NDAX_FEE, VENUE_KRAKEN: KRAKEN_FEE}
+
+BOOK_DEPTH = 10
+MAX_QUOTE_AGE = 2.0  # Seconds, older books are not traded against
+CASH = 300
+MIN_TRADE_VALUE = 0.5
+
+
+class CrossVenueMonitor:
+    """Ingests NDAX and Kraken market data in one event loop and evaluates
+    CrossVenueArbitrage whenever either venue's top of book moves.
+
+    Opportunities are logged with their paired orders. There is no Kraken
+    order entry in hermes yet, so nothing is sent.
+    """
+
+    def __init__(self, max_age=MAX_QUOTE_AGE, cash=CASH, min_trade_value=MIN_TRADE_VALUE):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.books = {
+            VENUE_NDAX: NDAXOrderbook(
+                instrument_keys=(CROSS_INSTRUMENTS[VENUE_NDAX],),
+                depth=BOOK_DEPTH,
+                backend="array",
+                instrument_specs=NDAX_INSTRUMENT_SPECS,
+            ),
+            VENUE_KRAKEN: KrakenOrderBook(
+                instrument_keys=(CROSS_INSTRUMENTS[VENUE_KRAKEN],),
+                depth=BOOK_DEPTH,
+                backend="array",
+                instrument_specs=KRAKEN_INSTRUMENT_SPECS,
+            ),
+        }
+        self.strategy = CrossVenueArbitrage(
+            self.books, CROSS_INSTRUMENTS, FEES, max_age=max_age
+        )
+        self.cash = cash
+        self.min_trade_value = min_trade_value
+
+    def start(self):
+        asyncio.run(self.run())
+
+    async def run(self):
+        ndax, kraken = await asyncio.gather(
+            websockets.connect(NDAX_URL), websockets.connect(KRAKEN_URL)
+        )
+        try:
+            await ndax.send(
+                create_subscribe_level2_req(
+                    CROSS_INSTRUMENTS[VENUE_NDAX], depth=BOOK_DEPTH
+                )
+            )
+            await kraken.send(
+                json.dumps(
+                    {
+                        "event": "subscribe",
+                        "pair": [CROSS_INSTRUMENTS[VENUE_KRAKEN]],
+                        "subscription": {"name": "book", "depth": BOOK_DEPTH},
+                    }
+                )
+            )
+
+            # One reader per venue. Both run on this loop, so an evaluation
+            # always sees each book between whole updates.
+            routers = {
+                VENUE_NDAX: NDAXMarketDataRouter(ndax, self.books[VENUE_NDAX]),
+                VENUE_KRAKEN: KrakenRouter(None, None, self.books[VENUE_KRAKEN], None),
+            }
+            await asyncio.gather(
+                self.read_loop(VENUE_NDAX, ndax, routers[VENUE_NDAX]),
+                self.read_loop(VENUE_KRAKEN, kraken, routers[VENUE_KRAKEN]),
+            )
+        finally:
+            await asyncio.gather(ndax.close(), kraken.close())
+
+    async def read_loop(self, venue, connection, router):
+        book = self.books[venue]
+        async for raw_message in connection:
+            await router.route(raw_message)
+            changed = book.pop_updated_instruments()
+            if changed and self.strategy.is_affected(venue, changed):
+                self.evaluate()
+
+    def evaluate(self):
+        edge = self.strategy.best_edge()
+        if edge is None:
+            return
+
+        net = self.strategy.net(self.cash, edge)
+        if net > self.min_trade_value:
+            self.logger.info(
+                f"Buy {edge.buy_venue} at {edge.ask_price}, sell {edge.sell_venue} at {edge.bid_price}: {net:.2f}"
+            )
+            for order in self.strategy.get_orders(self.cash, edge):
+                self.logger.info(f"Would send: {order}")
+
+
+if __name__ == "__main__":
+    CrossVenueMonitor().start()
@@ -6,33 +6,35 @@ import websockets
 import traceback
 import asyncio
 import json
-from hermes.orderbook.orderbook import MultiOrderBook
-from dataclasses import dataclass
+from hermes.orderbook.orderbook import MultiOrderBook, BID, ASK, scale_decimal_string
+from hermes.utils.structures import InstrumentSpec
 import logging
-from hermes.strategies.arbitrage.triangle import TriangleBSS
+from hermes.strategies.arbitrage.discovery import TriangleIndex
 
 DEMO_URL = "wss://ws.kraken.com"
 
 DEBUG = False
 
 TICKERS = ["XBT/CAD", "ETH/CAD", "XRP/CAD", "ETH/XBT", "XRP/XBT", "XRP/ETH"]
-TRIANGLE1 = ["ETH/CAD", "ETH/XBT", "XBT/CAD"]
-TRIANGLE2 = ["XRP/CAD", "XRP/XBT", "XBT/CAD"]
-TRIANGLE3 = ["XRP/CAD", "XRP/ETH", "ETH/CAD"]
+INSTRUMENT_ASSETS = {ticker: tuple(ticker.split("/")) for ticker in TICKERS}
+CASH_ASSET = "CAD"
+FEE = 0.0022
+
+# Kraken pair_decimals / lot_decimals for the book string values
+INSTRUMENT_SPECS = {
+    "XBT/CAD": InstrumentSpec(price_decimals=1, quantity_decimals=8),
+    "ETH/CAD": InstrumentSpec(price_decimals=2, quantity_decimals=8),
+    "XRP/CAD": InstrumentSpec(price_decimals=5, quantity_decimals=8),
+    "ETH/XBT": InstrumentSpec(price_decimals=5, quantity_decimals=8),
+    "XRP/XBT": InstrumentSpec(price_decimals=8, quantity_decimals=8),
+    "XRP/ETH": InstrumentSpec(price_decimals=7, quantity_decimals=8),
+}
 
 event_subscription = json.dumps(
     {"event": "subscribe", "pair": TICKERS, "subscription": {"name": "book"},}
 )
 
 
-@dataclass
-class KrakenL2Update:
-    ProductPairCode: str
-    Price: float
-    Quantity: float
-    Side: int
-
-
 DEPTH = 10
 
 
@@ -70,9 +72,9 @@ async def test(orderbook):
         await session.recv()
 
         snapshot_received = {ticker: False for ticker in TICKERS}
-        triangle1 = TriangleBSS(orderbook, instrument_ids=TRIANGLE1, fee=0.0022)
-        triangle2 = TriangleBSS(orderbook, instrument_ids=TRIANGLE2, fee=0.0022)
-        triangle3 = TriangleBSS(orderbook, instrument_ids=TRIANGLE3, fee=0.0022)
+        triangles = TriangleIndex.discover(
+            orderbook, INSTRUMENT_ASSETS, CASH_ASSET, fee=FEE
+        )
 
         async for raw_message in session:
             try:
@@ -82,12 +84,16 @@ async def test(orderbook):
                     continue
 
                 if not snapshot_received[message[-1]]:
-                    await orderbook.snapshot(message)
+                    changed = await orderbook.snapshot(message)
                     snapshot_received[message[-1]] = True
                 else:
-                    await orderbook.update(message)
+                    changed = await orderbook.update(message)
 
-                for triangle in [triangle1, triangle2, triangle3]:
+                # Only triangles trading an instrument whose L1 moved
+                for triangle in triangles.affected(changed or ()):
+                    if not triangle.crossed(changed):
+                        continue
+                    triangle = triangle.capture()
                     if DEBUG:
                         print(f'Forward: {triangle.forward()}')
                         print(f'Backward: {triangle.backward()}')
@@ -116,6 +122,15 @@ async def test(orderbook):
 
 
 class KrakenOrderBook(MultiOrderBook):
+    def register_handlers(self, router):
+        router.register("book", self.handle_book)
+
+    async def handle_book(self, payload):
+        # Snapshots carry "as"/"bs", updates carry "a"/"b"
+        if "as" in payload[1] or "bs" in payload[1]:
+            return await self.snapshot(payload)
+        return await self.update(payload)
+
     async def snapshot(self, payload):
         try:
             _id, book, _, instrument = payload
@@ -123,13 +138,13 @@ class KrakenOrderBook(MultiOrderBook):
             print(payload)
             return
 
-        for ask in book["as"]:
-            l2update = KrakenL2Update(instrument, *ask[:2], Side=1)
-            await self.handle_update(l2update)
-
-        for bid in book["bs"]:
-            l2update = KrakenL2Update(instrument, *bid[:2], Side=0)
-            await self.handle_update(l2update)
+        return self.apply_batch(
+            {
+                (instrument, ASK): self.collapse_levels(instrument, book["as"]),
+                (instrument, BID): self.collapse_levels(instrument, book["bs"]),
+            },
+            scaled=True,
+        )
 
     async def update(self, payload):
         if len(payload) == 4:
@@ -144,29 +159,28 @@ class KrakenOrderBook(MultiOrderBook):
         else:
             raise ValueError(f"What the fuck is this: {payload}")
 
-        for ask in ask_book:
-            l2update = KrakenL2Update(instrument, *ask[:2], Side=1)
-            await self.handle_update(l2update)
-
-        for bid in bid_book:
-            l2update = KrakenL2Update(instrument, *bid[:2], Side=0)
-            await self.handle_update(l2update)
-
-    async def handle_update(self, update: KrakenL2Update):
-        if update.Side == 0:
-            book_to_update = self.book[update.ProductPairCode].bid
-        else:
-            book_to_update = self.book[update.ProductPairCode].ask
-
-        quantity = float(update.Quantity)
-        price = float(update.Price)
-        if quantity == 0:  # deletion
-            try:
-                book_to_update.pop(price)
-            except KeyError:
-                print("why is there a key error")
-        else:
-            book_to_update[price] = quantity
+        return self.apply_batch(
+            {
+                (instrument, ASK): self.collapse_levels(instrument, ask_book),
+                (instrument, BID): self.collapse_levels(instrument, bid_book),
+            },
+            scaled=True,
+        )
+
+    def collapse_levels(self, instrument, levels):
+        # Kraken levels are [price, volume, timestamp(, "r")] with string values.
+        # A volume of 0 is a deletion; later entries for a price win.
+        spec = self.instrument_specs[instrument]
+        price_decimals = spec.price_decimals
+        quantity_decimals = spec.book_quantity_decimals
+        return {
+            scale_decimal_string(level[0], price_decimals): (
+                scale_decimal_string(level[1], quantity_decimals)
+                # Only a zero volume deletes, keep sub-precision volumes as one unit
+                or (1 if level[1].strip("0.") else 0)
+            )
+            for level in levels
+        }
 
 
 async def gather_all_tasks(orderbook):
@@ -174,5 +188,7 @@ async def gather_all_tasks(orderbook):
 
 
 if __name__ == "__main__":
-    orderbook = KrakenOrderBook(instrument_keys=TICKERS, depth=DEPTH)
+    orderbook = KrakenOrderBook(
+        instrument_keys=TICKERS, depth=DEPTH, instrument_specs=INSTRUMENT_SPECS
+    )
     asyncio.run(gather_all_tasks(orderbook))
@@ -1,13 +1,21 @@
 import asyncio
 import json
 import websockets
-import random
+from websockets.protocol import State
+from itertools import count
 from enum import Enum
 import logging
 from collections import namedtuple
 import datetime
 import traceback
 from hermes.utils.authorization import create_NDAX_signature
+from hermes.utils.ratelimit import (
+    SlidingWindowRateLimiter,
+    PRIORITY_ORDER,
+    PRIORITY_SUBSCRIPTION,
+    PRIORITY_ACCOUNT,
+)
+from hermes.utils.structures import InstrumentSpec
 
 SECRET_PATH = "secrets/ndax.json"
 NDAX_URL = "wss://api.ndax.io"
@@ -16,6 +24,12 @@ BTCCAD_ID = 1
 BTCUSDT_ID = 82
 USDTCAD_ID = 80
 
+INSTRUMENT_SPECS = {
+    BTCCAD_ID: InstrumentSpec(price_decimals=2, quantity_decimals=6),
+    BTCUSDT_ID: InstrumentSpec(price_decimals=2, quantity_decimals=6),
+    USDTCAD_ID: InstrumentSpec(price_decimals=4, quantity_decimals=2),
+}
+
 FEE = 0.002
 
 logging.basicConfig(level=logging.INFO)
@@ -57,10 +71,26 @@ class AuthError(Exception):
     pass
 
 
-def create_request(message_type: int, function_name: str, payload: dict) -> str:
-    i = random.randint(1, 10000)  # TODO thjis should be different/random
+class RequestError(Exception):
+    pass
+
+
+# Clients number their requests with even sequence numbers, and the reply
+# echoes the number back, so a request can be matched to its reply.
+_sequence_numbers = count(2, 2)
+
+
+def next_sequence_number() -> int:
+    return next(_sequence_numbers)
+
+
+def create_request(
+    message_type: int, function_name: str, payload: dict, sequence=None
+) -> str:
+    if sequence is None:
+        sequence = next_sequence_number()
     return json.dumps(
-        {"m": message_type, "i": i, "n": function_name, "o": json.dumps(payload)}
+        {"m": message_type, "i": sequence, "n": function_name, "o": json.dumps(payload)}
     )
 
 
@@ -86,6 +116,77 @@ def create_subscribe_level2_req(instrument_id: int, depth=5) -> str:
     return create_request(MESSAGE_TYPES["REQUEST"], "SubscribeLevel2", payload)
 
 
+def create_unsubscribe_level2_req(instrument_id: int) -> str:
+    payload = {"OMSId": 1, "InstrumentId": instrument_id}
+    return create_request(MESSAGE_TYPES["REQUEST"], "UnSubscribeLevel2", payload)
+
+
+class NDAXOrderEncoder:
+    """Encodes SendOrder requests from per-instrument templates.
+
+    The templates are built once with the constant fields (OMSId, AccountId,
+    OrderIdOCO, PegPriceType...) already serialized and escaped into the outer
+    frame, so encoding an order only formats the fields that vary. The output
+    matches create_request on the equivalent payload.
+    """
+
+    def __init__(self, account_id, instrument_specs=INSTRUMENT_SPECS):
+        self.quantity_decimals = {
+            _id: spec.quantity_decimals for _id, spec in instrument_specs.items()
+        }
+        self.templates = {
+            _id: self.compile_template(_id, account_id) for _id in instrument_specs
+        }
+
+    @staticmethod
+    def compile_template(instrument_id, account_id):
+        payload = {
+            "InstrumentId": instrument_id,
+            "OMSId": 1,
+            "AccountId": account_id,
+            "TimeInForce": "@time_in_force@",
+            "ClientOrderId": "@client_id@",
+            "OrderIdOCO": 0,
+            "UseDisplayQuantity": False,
+            "Side": "@side@",
+            "Quantity": "@quantity@",
+            "OrderType": "@order_type@",
+            "PegPriceType": 1,
+        }
+        frame = create_request(
+            MESSAGE_TYPES["REQUEST"], "SendOrder", payload, sequence="@sequence@"
+        )
+        # Placeholders were serialized as strings: once quoted in the frame,
+        # twice (escaped) inside "o". Swap them for format fields.
+        template = frame.replace("{", "{{").replace("}", "}}")
+        template = template.replace('"@sequence@"', "{sequence}")
+        for field in ("time_in_force", "client_id", "side", "quantity", "order_type"):
+            template = template.replace(f'\\"@{field}@\\"', f"{{{field}}}")
+        return template
+
+    def encode(self, client_id, order, sequence=None):
+        """encode.
+
+        :param client_id: ClientOrderId
+        :param order: Order, for an instrument this encoder has a template for
+        :param sequence: frame sequence number, the next one if None
+        """
+        if sequence is None:
+            sequence = next_sequence_number()
+        instrument_id = order.instrument_id
+        return self.templates[instrument_id].format(
+            sequence=sequence,
+            time_in_force=order.time_in_force,
+            client_id=client_id,
+            side=order.side,
+            # float repr is how json encodes floats
+            quantity=repr(
+                float(round(order.quantity, self.quantity_decimals[instrument_id]))
+            ),
+            order_type=order.order_type,
+        )
+
+
 class NDAXAuth:
     def __init__(self, user_id, api_key, secret):
         self.user_id = user_id
@@ -114,37 +215,166 @@ class NDAXAuth:
 
 
 class NDAXSession:
-    def __init__(self, user_id, apikey, secret, rate_limit=50):
+    def __init__(self, user_id, apikey, secret, rate_limit=50, reserved_for_orders=10):
         self.auth_manager = NDAXAuth(user_id, apikey, secret)
         self.logger = logging.getLogger(self.__class__.__name__)
         self.rate_limit=rate_limit
-        self.call_counter = 0
+        self.rate_limiter = SlidingWindowRateLimiter(
+            rate_limit, window=60, reserved=reserved_for_orders
+        )
+        self.pending_requests = {}  # sequence number -> future
+        self.session = None
+        self.market_data = None
+
+    @property
+    def connected(self):
+        return all(
+            connection is not None and connection.state is State.OPEN
+            for connection in (self.session, self.market_data)
+        )
 
+    def create_standby(self):
+        """create_standby.
+        A session with the same credentials and rate limit budget, to be
+        connected ahead of time and taken over with adopt().
+        """
+        auth = self.auth_manager
+        standby = NDAXSession(auth.user_id, auth.api_key, auth.secret)
+        standby.rate_limiter = self.rate_limiter
+        return standby
+
+    async def connect(self, interactive=True):
+        """connect.
+
+        :param interactive: whether a 2FA code may be prompted for on stdin.
+            The prompt blocks the event loop, so background connections pass False.
+        :raises MFAError: if the account requires 2FA and interactive is False
+        """
+        await self.initialize_session()
+        await self.authenticate(interactive)
+
+    def adopt(self, standby):
+        """adopt.
+        Take over the connections of a connected, authenticated standby session.
+        This session's own connections should already be closed. Requests
+        awaiting replies on them fail, since those replies will never arrive.
+
+        :param standby: session from create_standby()
+        """
+        self.fail_pending_requests(RequestError("Session replaced"))
+        self.session, self.market_data = standby.session, standby.market_data
+        self.session_token = standby.session_token
+        standby.session = standby.market_data = None
 
     async def initialize_session(self):
-        self.session = await websockets.connect(NDAX_URL)
+        # Orders and account events get their own authenticated connection, so
+        # acks and fills never queue behind book traffic. Level2 subscriptions
+        # go on the unauthenticated market data connection.
+        self.session, self.market_data = await asyncio.gather(
+            websockets.connect(NDAX_URL), websockets.connect(NDAX_URL)
+        )
 
     async def close(self):
-        await self.session.close()
-
-    async def send(self, message):
+        self.fail_pending_requests(RequestError("Session closed"))
+        await asyncio.gather(
+            *(
+                connection.close()
+                for connection in (self.session, self.market_data)
+                if connection is not None
+            )
+        )
 
+    async def request(
+        self,
+        function_name,
+        payload,
+        timeout=10.0,
+        priority=PRIORITY_ACCOUNT,
+        market_data=False,
+    ):
+        """request.
+        Send a request and wait for its reply. The reply is only seen by the
+        router, so this must not be awaited from inside a router handler.
+
+        :param function_name: NDAX function, e.g. GetAccountPositions
+        :param payload: request payload
+        :param timeout: seconds to wait for the reply
+        :param priority: rate limit priority
+        :param market_data: send on the market data connection
+        :returns: the parsed reply payload, after the router's handlers have run
+        :raises RequestError: if the server answers with an error frame
+        :raises asyncio.TimeoutError: if no reply arrives in time
+        """
+        sequence = next_sequence_number()
+        future = asyncio.get_event_loop().create_future()
+        self.pending_requests[sequence] = future
+        send = self.send_market_data if market_data else self.send
+        try:
+            await send(
+                create_request(
+                    MESSAGE_TYPES["REQUEST"], function_name, payload, sequence
+                ),
+                priority=priority,
+            )
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending_requests.pop(sequence, None)
+
+    def resolve_request(self, message):
+        """resolve_request.
+        Complete the request the reply answers, if anything is waiting on it.
+
+        :param message: decoded NDAXMessage reply
+        """
+        future = self.pending_requests.pop(message.sequence, None)
+        if future is None or future.done():
+            return
+
+        if message.message_type == MESSAGE_TYPES["ERROR"]:
+            future.set_exception(
+                RequestError(f"{message.message_fn} failed: {message.payload}")
+            )
+        else:
+            future.set_result(message.payload)
+
+    def fail_pending_requests(self, exception):
+        for future in self.pending_requests.values():
+            if not future.done():
+                future.set_exception(exception)
+        self.pending_requests.clear()
+
+    async def send(self, message, priority=PRIORITY_ACCOUNT):
+        """send.
+        Wait for rate limit budget, then send.
+
+        :param message: encoded request
+        :param priority: one of the hermes.utils.ratelimit priorities. Order entry
+            should use PRIORITY_ORDER so it is never starved by other traffic.
+        """
+        await self.rate_limiter.acquire(priority)
         await self.session.send(message)
-        asyncio.create_task(self._increment_and_decrement_call_counter())
+
+    async def send_market_data(self, message, priority=PRIORITY_SUBSCRIPTION):
+        """send_market_data.
+        Like send, on the market data connection.
+        """
+        await self.rate_limiter.acquire(priority)
+        await self.market_data.send(message)
 
     @property
     def limited(self):
-        return self.call_counter > self.rate_limit
+        return self.rate_limiter.available() == 0
 
     async def recv(self):
         return await self.session.recv()
 
     async def _send_and_receive(self, req):
+        await self.rate_limiter.acquire(PRIORITY_ORDER)
         await self.session.send(req)
         response = await self.session.recv()
         return json.loads(response)
 
-    async def authenticate(self):
+    async def authenticate(self, interactive=True):
         self.logger.info("Authenticating...")
         auth_req = self.auth_manager.get_authenticate_user_request()
 
@@ -157,6 +387,8 @@ class NDAXSession:
             raise AuthError(f"Authentication refused. Returned message: {payload}")
 
         if payload["Authenticated"] and payload["Requires2FA"]:
+            if not interactive:
+                raise MFAError("Account requires 2FA, which needs an interactive login")
             self.session_token = await self._authenticate_mfa()
         else:
             self.session_token = payload["SessionToken"]
@@ -172,17 +404,3 @@ class NDAXSession:
             return payload["SessionToken"]
         else:
             raise MFAError(f"MFA Failed: {payload}")
-
-    async def _wait_one_minute_then_clear_rate_limit(self):
-        await asyncio.sleep(60)
-        self.limited = False
-
-    async def _increment_and_decrement_call_counter(self, interval=60):
-        # Debug
-        print('incrementing')
-        self.call_counter += 1
-        await asyncio.sleep(interval)
-        print('decrementing')
-        self.call_counter -= 1
-
-
@@ -1,9 +1,15 @@
 import asyncio
+from array import array
 from asyncio import Condition
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass
 from sortedcontainers import SortedDict, SortedItemsView
 from collections import namedtuple
 import logging
+from math import inf
+from time import monotonic, perf_counter_ns
+
+from hermes.utils.latency import LatencyTracer, STAGE_BOOK
 
 L2Update = namedtuple(
     "L2Update",
@@ -21,6 +27,40 @@ L2Update = namedtuple(
     ],
 )
 
+# Column positions of the raw NDAX L2 rows, used by the batched apply path
+L2_MD_UPDATE_ID = L2Update._fields.index("MDUpdateId")
+L2_ACTION_TYPE = L2Update._fields.index("ActionType")
+L2_PRICE = L2Update._fields.index("Price")
+L2_PRODUCT_PAIR_CODE = L2Update._fields.index("ProductPairCode")
+L2_QUANTITY = L2Update._fields.index("Quantity")
+L2_SIDE = L2Update._fields.index("Side")
+
+BID = 0
+ASK = 1
+
+
+def scale_decimal_string(text, decimals):
+    """scale_decimal_string.
+    Convert a decimal string such as "68971.60000" straight to a scaled
+    integer without going through float. Extra fractional digits are truncated.
+
+    :param text: decimal string
+    :param decimals: number of decimal places in the target unit
+    """
+    whole, _, fraction = text.partition(".")
+    return int(whole + fraction[:decimals].ljust(decimals, "0"))
+
+
+def scale_quantity(quantity, quantity_scale):
+    """scale_quantity.
+    Scale a level quantity. Only a raw 0 is a deletion, so a nonzero quantity
+    below one unit of the book precision is kept as one unit.
+    """
+    scaled = round(quantity * quantity_scale)
+    if not scaled and quantity:
+        return 1
+    return scaled
+
 
 class AskSide(SortedDict):
     def __init__(self, depth, *args, **kwargs):
@@ -44,9 +84,100 @@ class BidSide(SortedDict):
             self.popitem(0)
 
 
-class OrderBook:
-    def __init__(self, depth, use_depth_limiter=True):
+class BaseOrderBook:
+    """Price/quantity scaling shared by the OrderBook backends.
+
+    Books built with an InstrumentSpec keep prices and quantities as scaled
+    integers on both sides: prices in ticks, quantities at the spec's book
+    precision, which is finer than the order lot. The get_*/best_* reads convert
+    back to floats for strategies, while top_of_book and the sides themselves
+    stay in integer units.
+    """
+
+    def __init__(self, depth, spec=None):
         self.depth = depth
+        self.spec = spec
+        self.scaled = spec is not None
+        self.price_scale = 10 ** spec.price_decimals if self.scaled else 1
+        self.quantity_scale = 10 ** spec.book_quantity_decimals if self.scaled else 1
+
+    def scale_levels(self, levels):
+        if not self.scaled:
+            return levels
+
+        price_scale = self.price_scale
+        quantity_scale = self.quantity_scale
+        return {
+            round(price * price_scale): scale_quantity(quantity, quantity_scale)
+            for price, quantity in levels.items()
+        }
+
+    def unscale_levels(self, levels):
+        price_scale = self.price_scale
+        quantity_scale = self.quantity_scale
+        return [
+            (price / price_scale, quantity / quantity_scale)
+            for price, quantity in levels
+        ]
+
+    def unscale_prices(self, prices):
+        price_scale = self.price_scale
+        return [price / price_scale for price in prices]
+
+    # Depth queries. side is the book side being consumed: a buy walks ASK,
+    # a sell walks BID. These walk the levels; backends with maintained
+    # prefix sums override them.
+    def vwap(self, side, quantity):
+        """vwap.
+        Average price to fill quantity base against one side of the book.
+
+        :param side: BID or ASK
+        :param quantity: base quantity to fill, > 0
+        :returns: the VWAP, or None if the book is too thin
+        """
+        remaining = quantity
+        notional = 0.0
+        for price, level_quantity in self.get_bids() if side == BID else self.get_asks():
+            if level_quantity >= remaining:
+                return (notional + remaining * price) / quantity
+            notional += level_quantity * price
+            remaining -= level_quantity
+        return None
+
+    def quantity_within_price(self, side, price):
+        """Base quantity fillable on side at prices no worse than price."""
+        total = 0.0
+        for level_price, level_quantity in self._levels_within(side, price):
+            total += level_quantity
+        return total
+
+    def notional_within_price(self, side, price):
+        """Notional fillable on side at prices no worse than price."""
+        total = 0.0
+        for level_price, level_quantity in self._levels_within(side, price):
+            total += level_price * level_quantity
+        return total
+
+    def notional_within_bps(self, side, bps):
+        """Notional available on side within bps basis points of its best price."""
+        try:
+            if side == BID:
+                limit = self.best_bid_price() * (1 - bps / 10000)
+            else:
+                limit = self.best_ask_price() * (1 + bps / 10000)
+        except IndexError:
+            return 0.0
+        return self.notional_within_price(side, limit)
+
+    def _levels_within(self, side, price):
+        if side == BID:
+            return (level for level in self.get_bids() if level[0] >= price)
+        return (level for level in self.get_asks() if level[0] <= price)
+
+
+class OrderBook(BaseOrderBook):
+    def __init__(self, depth, use_depth_limiter=True, spec=None):
+        super().__init__(depth, spec=spec)
 
         if use_depth_limiter:
             self.bid = BidSide(depth)
@@ -61,40 +192,561 @@ class OrderBook:
         self.ask_prices = self.ask.keys()
         self.bid_prices = self.bid.keys()
 
-    def get_bids(self):
-        return self.bid_depth_view[: -self.depth - 1 : -1]
+    def get_bids(self, depth=None):
+        bids = self.bid_depth_view[: -(depth or self.depth) - 1 : -1]
+        return self.unscale_levels(bids) if self.scaled else bids
+
+    def get_asks(self, depth=None):
+        asks = self.ask_depth_view[: depth or self.depth]
+        return self.unscale_levels(asks) if self.scaled else asks
+
+    def get_ask_prices(self):
+        prices = self.ask_prices[: self.depth]
+        return self.unscale_prices(prices) if self.scaled else prices
+
+    def get_bid_prices(self):
+        prices = self.bid_prices[: -self.depth - 1 : -1]
+        return self.unscale_prices(prices) if self.scaled else prices
+
+    def best_ask_price(self):
+        return self.ask.peekitem(0)[0] / self.price_scale
+
+    def best_ask_quantity(self):
+        return self.ask.peekitem(0)[1] / self.quantity_scale
+
+    def best_bid_price(self):
+        return self.bid.peekitem(-1)[0] / self.price_scale
+
+    def best_bid_quantity(self):
+        return self.bid.peekitem(-1)[1] / self.quantity_scale
+
+    def apply_levels(self, side, levels):
+        """apply_levels.
+        Apply a batch of collapsed level changes to one side of the book.
+        Deletions go first so inserts don't push out levels that are about
+        to be freed.
+
+        :param side: BID or ASK
+        :param levels: dict of price -> quantity in book units, where a quantity of 0 deletes the level
+        """
+        book_side = self.bid if side == BID else self.ask
+        for price, quantity in levels.items():
+            if not quantity:
+                book_side.pop(price, None)
+
+        for price, quantity in levels.items():
+            if quantity:
+                book_side[price] = quantity
+
+    def top_of_book(self):
+        bid_price, bid_qty = self.bid.peekitem(-1) if self.bid else (None, None)
+        ask_price, ask_qty = self.ask.peekitem(0) if self.ask else (None, None)
+        return bid_price, bid_qty, ask_price, ask_qty
+
+
+class ArraySide:
+    """Fixed-depth price ladder backed by preallocated arrays.
+
+    Levels are stored best-first. Bids are kept under negated keys so both
+    sides can share an ascending bisect. Inserts and deletes shift the tail
+    of the arrays in place, and the best level is always at index 0.
+
+    Prefix sums of quantity and notional (in float units) are kept alongside
+    and refreshed from the first changed level on every write.
+    """
+
+    def __init__(
+        self, depth, descending=False, typecode="d", price_scale=1, quantity_scale=1
+    ):
+        self.depth = depth
+        self.sign = -1 if descending else 1
+        self.price_scale = price_scale
+        self.quantity_scale = quantity_scale
+        self.keys = array(typecode, bytes(8 * depth))
+        self.quantities = array(typecode, bytes(8 * depth))
+        self.cumulative_quantities = array("d", bytes(8 * depth))
+        self.cumulative_notional = array("d", bytes(8 * depth))
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __setitem__(self, price, quantity):
+        key = price * self.sign
+        keys = self.keys
+        size = self.size
+        i = bisect_left(keys, key, 0, size)
+
+        if i < size and keys[i] == key:
+            self.quantities[i] = quantity
+            self.accumulate(i)
+            return
+
+        if i >= self.depth:  # Worse than every level we keep
+            return
+
+        if size == self.depth:  # Drop the worst level to make room
+            size -= 1
+
+        quantities = self.quantities
+        keys[i + 1 : size + 1] = keys[i:size]
+        quantities[i + 1 : size + 1] = quantities[i:size]
+        keys[i] = key
+        quantities[i] = quantity
+        self.size = size + 1
+        self.accumulate(i)
+
+    def pop(self, price):
+        key = price * self.sign
+        keys = self.keys
+        size = self.size
+        i = bisect_left(keys, key, 0, size)
+        if i == size or keys[i] != key:
+            raise KeyError(price)
+
+        quantities = self.quantities
+        quantity = quantities[i]
+        keys[i : size - 1] = keys[i + 1 : size]
+        quantities[i : size - 1] = quantities[i + 1 : size]
+        self.size = size - 1
+        self.accumulate(i)
+        return quantity
+
+    def apply_levels(self, levels):
+        # Same as calling pop/__setitem__ per level, inlined so a whole batch
+        # runs in one call. Deletions go first, as in OrderBook.apply_levels.
+        sign = self.sign
+        depth = self.depth
+        keys = self.keys
+        quantities = self.quantities
+        size = self.size
+        first_changed = depth
+
+        for price, quantity in levels.items():
+            if quantity:
+                continue
+            key = price * sign
+            i = bisect_left(keys, key, 0, size)
+            if i < size and keys[i] == key:
+                keys[i : size - 1] = keys[i + 1 : size]
+                quantities[i : size - 1] = quantities[i + 1 : size]
+                size -= 1
+                if i < first_changed:
+                    first_changed = i
+
+        for price, quantity in levels.items():
+            if not quantity:
+                continue
+            key = price * sign
+            i = bisect_left(keys, key, 0, size)
+            if i < size and keys[i] == key:
+                quantities[i] = quantity
+            elif i < depth:
+                if size == depth:
+                    size -= 1
+                keys[i + 1 : size + 1] = keys[i:size]
+                quantities[i + 1 : size + 1] = quantities[i:size]
+                keys[i] = key
+                quantities[i] = quantity
+                size += 1
+            else:
+                continue
+            if i < first_changed:
+                first_changed = i
+
+        self.size = size
+        if first_changed < size:
+            self.accumulate(first_changed)
+
+    def accumulate(self, start):
+        """Refresh the prefix sums from level start to the end of the ladder."""
+        keys = self.keys
+        quantities = self.quantities
+        cumulative_quantities = self.cumulative_quantities
+        cumulative_notional = self.cumulative_notional
+        price_factor = self.sign / self.price_scale
+        quantity_scale = self.quantity_scale
+
+        if start:
+            total_quantity = cumulative_quantities[start - 1]
+            total_notional = cumulative_notional[start - 1]
+        else:
+            total_quantity = total_notional = 0.0
+
+        for i in range(start, self.size):
+            quantity = quantities[i] / quantity_scale
+            total_quantity += quantity
+            total_notional += quantity * keys[i] * price_factor
+            cumulative_quantities[i] = total_quantity
+            cumulative_notional[i] = total_notional
+
+    def vwap(self, quantity):
+        size = self.size
+        cumulative_quantities = self.cumulative_quantities
+        i = bisect_left(cumulative_quantities, quantity, 0, size)
+        if i == size:
+            return None  # Not enough depth
+
+        if i:
+            filled = cumulative_quantities[i - 1]
+            notional = self.cumulative_notional[i - 1]
+        else:
+            filled = notional = 0.0
+        price = self.keys[i] * self.sign / self.price_scale
+        return (notional + (quantity - filled) * price) / quantity
+
+    def levels_within(self, price):
+        key = price * self.sign * self.price_scale
+        if self.price_scale != 1:
+            key += 1e-6  # Absorb float error against integer ticks
+        return bisect_right(self.keys, key, 0, self.size)
+
+    def quantity_within(self, price):
+        i = self.levels_within(price)
+        return self.cumulative_quantities[i - 1] if i else 0.0
+
+    def notional_within(self, price):
+        i = self.levels_within(price)
+        return self.cumulative_notional[i - 1] if i else 0.0
+
+    def clear(self):
+        self.size = 0
+
+    def best_price(self):
+        if not self.size:
+            raise IndexError("ladder is empty")
+        return self.keys[0] * self.sign
+
+    def best_quantity(self):
+        if not self.size:
+            raise IndexError("ladder is empty")
+        return self.quantities[0]
+
+    def prices(self):
+        sign = self.sign
+        return [key * sign for key in self.keys[: self.size]]
+
+    def items(self, count=None):
+        sign = self.sign
+        size = self.size if count is None else min(count, self.size)
+        return [
+            (key * sign, quantity)
+            for key, quantity in zip(self.keys[:size], self.quantities[:size])
+        ]
+
+
+class ArrayOrderBook(BaseOrderBook):
+    """OrderBook backend that keeps each side in a fixed-depth ArraySide.
+
+    Exposes the same read interface as OrderBook. The ladder is always depth
+    limited, so use_depth_limiter is accepted only for signature parity.
+    Scaled books use integer arrays.
+    """
+
+    def __init__(self, depth, use_depth_limiter=True, spec=None):
+        super().__init__(depth, spec=spec)
+        typecode = "q" if self.scaled else "d"
+        scales = dict(price_scale=self.price_scale, quantity_scale=self.quantity_scale)
+        self.bid = ArraySide(depth, descending=True, typecode=typecode, **scales)
+        self.ask = ArraySide(depth, typecode=typecode, **scales)
 
-    def get_asks(self):
-        return self.ask_depth_view[: self.depth]
+    def get_bids(self, depth=None):
+        bids = self.bid.items(depth)
+        return self.unscale_levels(bids) if self.scaled else bids
+
+    def get_asks(self, depth=None):
+        asks = self.ask.items(depth)
+        return self.unscale_levels(asks) if self.scaled else asks
 
     def get_ask_prices(self):
-        return self.ask_prices[: self.depth]
+        prices = self.ask.prices()
+        return self.unscale_prices(prices) if self.scaled else prices
 
     def get_bid_prices(self):
-        return self.bid_prices[: -self.depth - 1 : -1]
+        prices = self.bid.prices()
+        return self.unscale_prices(prices) if self.scaled else prices
+
+    def best_ask_price(self):
+        return self.ask.best_price() / self.price_scale
+
+    def best_ask_quantity(self):
+        return self.ask.best_quantity() / self.quantity_scale
+
+    def best_bid_price(self):
+        return self.bid.best_price() / self.price_scale
+
+    def best_bid_quantity(self):
+        return self.bid.best_quantity() / self.quantity_scale
+
+    def apply_levels(self, side, levels):
+        (self.bid if side == BID else self.ask).apply_levels(levels)
+
+    # Depth queries answered from the maintained prefix sums
+    def vwap(self, side, quantity):
+        return (self.bid if side == BID else self.ask).vwap(quantity)
+
+    def quantity_within_price(self, side, price):
+        return (self.bid if side == BID else self.ask).quantity_within(price)
+
+    def notional_within_price(self, side, price):
+        return (self.bid if side == BID else self.ask).notional_within(price)
+
+    def top_of_book(self):
+        bid, ask = self.bid, self.ask
+        if bid.size:
+            bid_price, bid_qty = -bid.keys[0], bid.quantities[0]
+        else:
+            bid_price = bid_qty = None
+        if ask.size:
+            ask_price, ask_qty = ask.keys[0], ask.quantities[0]
+        else:
+            ask_price = ask_qty = None
+        return bid_price, bid_qty, ask_price, ask_qty
+
+
+BOOK_BACKENDS = {"sorted": OrderBook, "array": ArrayOrderBook}
+
+
+class BookLevels:
+    """Immutable capture of one instrument's ladder, best level first.
+
+    Offers the OrderBook read interface so strategies can run against it
+    unchanged. Prices and quantities are floats.
+    """
+
+    __slots__ = ("bids", "asks", "version")
+
+    def __init__(self, bids, asks, version=0):
+        self.bids = bids
+        self.asks = asks
+        self.version = version
+
+    def get_bids(self, depth=None):
+        return self.bids[:depth]
+
+    def get_asks(self, depth=None):
+        return self.asks[:depth]
+
+    def get_ask_prices(self):
+        return [price for price, _ in self.asks]
+
+    def get_bid_prices(self):
+        return [price for price, _ in self.bids]
+
+    def best_ask_price(self):
+        return self.asks[0][0]
+
+    def best_ask_quantity(self):
+        return self.asks[0][1]
+
+    def best_bid_price(self):
+        return self.bids[0][0]
+
+    def best_bid_quantity(self):
+        return self.bids[0][1]
+
+
+class BookSnapshot:
+    """Consistent capture of several instruments, indexed like a MultiOrderBook."""
+
+    update_counter = 0  # Immutable, so it never changes
+
+    def __init__(self, levels):
+        self.levels = levels
+
+    def __getitem__(self, key):
+        return self.levels[key]
+
+    @property
+    def versions(self):
+        return {_id: levels.version for _id, levels in self.levels.items()}
 
 
 class MultiOrderBook:
-    def __init__(self, instrument_keys=(1, 80, 82), depth=5, use_depth_limiter=True):
+    """Books of several instruments, with top of book and sequence tracking.
+
+    Change book sides only through apply_batch (or the update and snapshot
+    handlers built on it). Writing to a side directly skips the top of book
+    refresh, so top_of_book, its versions and update_counter go stale along
+    with everything that reads them.
+    """
+
+    def __init__(
+        self,
+        instrument_keys=(1, 80, 82),
+        depth=5,
+        use_depth_limiter=True,
+        backend="sorted",
+        instrument_specs=None,
+    ):
         self.book = {}
+        self.backend = BOOK_BACKENDS[backend]
+        self.instrument_specs = instrument_specs or {}
+
+        # Top-of-book tracking: last seen L1 per instrument, a version that
+        # bumps whenever it moves, and the instruments that moved since the
+        # last call to pop_updated_instruments.
+        self.top_of_book = {}
+        self.top_of_book_version = {}
+        self.updated_instruments = set()
+        self.update_counter = 0  # Bumps whenever any L1 changes
+        self.last_update_time = {}  # Monotonic time of each instrument's last applied batch
+
+        # Sequence tracking: last applied MDUpdateId per instrument, books that
+        # saw a gap and are waiting on a fresh snapshot, and the subset of
+        # those whose resubscription has not been sent yet.
+        self.last_update_id = {}
+        self.invalid_instruments = set()
+        self.resync_requests = set()
+
         self.initialize_book(instrument_keys, depth, use_depth_limiter=use_depth_limiter)
         self.depth = depth
         self.logger = logging.getLogger(self.__class__.__name__)
-
+        self.tracer = LatencyTracer.instance()
 
     def initialize_book(self, instrument_ids, depth, use_depth_limiter=True):
         for _id in instrument_ids:
-            self.book[_id] = OrderBook(depth, use_depth_limiter=use_depth_limiter)
+            self[_id] = self.backend(
+                depth,
+                use_depth_limiter=use_depth_limiter,
+                spec=self.instrument_specs.get(_id),
+            )
 
     def __getitem__(self, key):
         return self.book[key]
 
     def __setitem__(self, key, value):
         self.book[key] = value
+        self.top_of_book[key] = value.top_of_book()
+        self.top_of_book_version[key] = self.top_of_book_version.get(key, 0) + 1
+        self.update_counter += 1
+
+    def refresh_top_of_book(self, instrument_ids):
+        """refresh_top_of_book.
+        Compare the current L1 of each instrument against the last seen value
+        and bump the version of the ones that moved.
+
+        :param instrument_ids: instruments touched by the last applied batch
+        :returns: set of instruments whose best bid/ask price or quantity changed
+        """
+        changed = set()
+        for _id in instrument_ids:
+            top = self.book[_id].top_of_book()
+            if top != self.top_of_book[_id]:
+                self.top_of_book[_id] = top
+                self.top_of_book_version[_id] += 1
+                changed.add(_id)
+
+        if changed:
+            self.update_counter += 1
+            self.updated_instruments |= changed
+        return changed
+
+    def apply_batch(self, groups, scaled=False):
+        """apply_batch.
+        Apply grouped level changes, one call per book side.
+
+        :param groups: dict of (instrument_id, side) -> {price: quantity}
+        :param scaled: whether the levels are already in the books' integer units
+        :returns: set of instruments whose top of book changed
+        """
+        book = self.book
+        for (instrument_id, side), levels in groups.items():
+            instrument_book = book[instrument_id]
+            if not scaled:
+                levels = instrument_book.scale_levels(levels)
+            instrument_book.apply_levels(side, levels)
+
+        instrument_ids = {instrument_id for instrument_id, _ in groups}
+        now = monotonic()
+        last_update_time = self.last_update_time
+        for instrument_id in instrument_ids:
+            last_update_time[instrument_id] = now
+        return self.refresh_top_of_book(instrument_ids)
+
+    def is_fresh(self, instrument_ids, max_age, now=None):
+        """is_fresh.
+        Whether every instrument had a batch applied in the last max_age seconds.
+
+        :param instrument_ids: instruments to check
+        :param max_age: seconds
+        :param now: monotonic time, defaults to the current one
+        """
+        if now is None:
+            now = monotonic()
+        last_update_time = self.last_update_time
+        return all(
+            now - last_update_time.get(_id, -inf) <= max_age for _id in instrument_ids
+        )
+
+    def invalidate(self, instrument_id):
+        """invalidate.
+        Drop the book of a single instrument and flag it for resubscription.
+        Updates for it are ignored until a new snapshot arrives.
+
+        :param instrument_id: instrument whose book can no longer be trusted
+        """
+        book = self.book[instrument_id]
+        book.ask.clear()
+        book.bid.clear()
+        self.last_update_id.pop(instrument_id, None)
+        self.invalid_instruments.add(instrument_id)
+        self.resync_requests.add(instrument_id)
+        self.refresh_top_of_book((instrument_id,))
+
+    def mark_synced(self, instrument_id):
+        """mark_synced.
+        A snapshot for the instrument arrived, so its book can be traded
+        again. The snapshot may have had no rows for it.
+        """
+        self.invalid_instruments.discard(instrument_id)
+        self.resync_requests.discard(instrument_id)
+
+    def request_resync(self, instrument_id):
+        """request_resync.
+        Queue another resubscription for a book that is still invalid, such as
+        after its snapshot never arrived.
+        """
+        if instrument_id in self.invalid_instruments:
+            self.resync_requests.add(instrument_id)
+
+    def is_valid(self, instrument_ids):
+        return self.invalid_instruments.isdisjoint(instrument_ids)
+
+    def pop_resync_requests(self):
+        requests = self.resync_requests
+        self.resync_requests = set()
+        return requests
+
+    def capture(self, instrument_ids, depth=1):
+        """capture.
+        Take an immutable snapshot of some instruments so a strategy can value
+        and size a trade from the same prices.
+
+        :param instrument_ids: instruments to capture
+        :param depth: levels per side to capture, None for the full book depth
+        :returns: BookSnapshot with the OrderBook read interface
+        """
+        versions = self.top_of_book_version
+        levels = {}
+        for _id in instrument_ids:
+            book = self.book[_id]
+            levels[_id] = BookLevels(
+                tuple(book.get_bids(depth)), tuple(book.get_asks(depth)), versions[_id]
+            )
+        return BookSnapshot(levels)
+
+    def pop_updated_instruments(self):
+        updated = self.updated_instruments
+        self.updated_instruments = set()
+        return updated
 
     async def update(self, payload):
         raise NotImplementedError("Please use a child class")
 
+    def register_handlers(self, router):
+        raise NotImplementedError("Please use a child class")
+
     def print_orderbook(self, depth=1):
         for k, v in self.book.items():
             try:
@@ -125,11 +777,86 @@ class MultiOrderBook:
         for book in self.book.values():
             book.ask.clear()
             book.bid.clear()
+        self.last_update_id.clear()
+        self.last_update_time.clear()
+        self.invalid_instruments.clear()
+        self.resync_requests.clear()
+        self.refresh_top_of_book(self.book)
 
 
 class NDAXOrderbook(MultiOrderBook):
+    def register_handlers(self, router):
+        router.register("SubscribeLevel2", self.snapshot)
+        router.register("Level2UpdateEvent", self.update)
+
     async def update(self, payload):
+        start = perf_counter_ns() if self.tracer.enabled else 0
         # for update in sorted(payload, key=lambda x: x[2]): # sort by action date time
-        for update in payload:
-            self.handle_update(L2Update(*update))
+        # Group the raw rows by book side, collapsing repeated prices so only
+        # the last write per level is applied.
+        groups = {}
+        last_update_id = self.last_update_id
+        invalid_instruments = self.invalid_instruments
+        for row in payload:
+            instrument_id = row[L2_PRODUCT_PAIR_CODE]
+            if instrument_id in invalid_instruments:
+                continue  # Waiting on a snapshot
+
+            # Rows of one update share an MDUpdateId, and consecutive updates
+            # increment it by one. Older ids are stale or duplicates, such as
+            # updates the snapshot already covers, and are dropped. A jump
+            # means we missed an update and the book has to be rebuilt.
+            update_id = row[L2_MD_UPDATE_ID]
+            last_id = last_update_id.get(instrument_id)
+            if last_id is not None and update_id < last_id:
+                continue
+            if last_id is not None and update_id > last_id + 1:
+                self.logger.warning(
+                    f"MDUpdateId gap on {instrument_id}: {last_id} -> {update_id}. Resyncing."
+                )
+                groups.pop((instrument_id, BID), None)
+                groups.pop((instrument_id, ASK), None)
+                self.invalidate(instrument_id)
+                continue
+            last_update_id[instrument_id] = update_id
+
+            group_key = (instrument_id, row[L2_SIDE])
+            levels = groups.get(group_key)
+            if levels is None:
+                levels = groups[group_key] = {}
+            levels[row[L2_PRICE]] = row[L2_QUANTITY] if row[L2_ACTION_TYPE] < 2 else 0
+
+        changed = self.apply_batch(groups)
+        if start:
+            self.tracer.record(STAGE_BOOK, start)
+        return changed
+
+    async def snapshot(self, payload):
+        """snapshot.
+        Rebuild the books contained in a SubscribeLevel2 reply from scratch and
+        restart their sequence tracking.
+
+        :param payload: list of raw L2 rows
+        """
+        groups = {}
+        snapshot_ids = {}
+        for row in payload:
+            instrument_id = row[L2_PRODUCT_PAIR_CODE]
+            update_id = row[L2_MD_UPDATE_ID]
+            if update_id > snapshot_ids.get(instrument_id, -1):
+                snapshot_ids[instrument_id] = update_id
+
+            group_key = (instrument_id, row[L2_SIDE])
+            levels = groups.get(group_key)
+            if levels is None:
+                levels = groups[group_key] = {}
+            levels[row[L2_PRICE]] = row[L2_QUANTITY] if row[L2_ACTION_TYPE] < 2 else 0
+
+        for instrument_id, update_id in snapshot_ids.items():
+            book = self.book[instrument_id]
+            book.ask.clear()
+            book.bid.clear()
+            self.last_update_id[instrument_id] = update_id
+            self.mark_synced(instrument_id)
 
+        return self.apply_batch(groups)
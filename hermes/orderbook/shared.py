@@ -0,0 +1,250 @@
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from hermes.orderbook.orderbook import (
+    MultiOrderBook,
+    NDAXOrderbook,
+    BookLevels,
+    BookSnapshot,
+)
+
+# Segment layout, in 8 byte words:
+#   header: magic, number of instruments, depth, batch counter
+#   one slot per instrument, in instrument_keys order:
+#     sequence, valid flag, bid count, ask count,
+#     bid prices[depth], bid quantities[depth], ask prices[depth], ask quantities[depth]
+# The sequence is a seqlock: odd while the writer is publishing the slot.
+MAGIC = 0x4845524D4553  # "HERMES"
+HEADER_WORDS = 4
+SLOT_HEADER_WORDS = 4
+
+HEADER_MAGIC = 0
+HEADER_INSTRUMENTS = 1
+HEADER_DEPTH = 2
+HEADER_BATCH = 3
+
+# A publish takes microseconds. A slot still busy after this many read attempts
+# means the writer died mid-publish, and waiting longer would block the reader.
+MAX_READ_ATTEMPTS = 100000
+
+
+class SeqlockTimeout(Exception):
+    pass
+
+
+def slot_words(depth):
+    return SLOT_HEADER_WORDS + 4 * depth
+
+
+def segment_size(n_instruments, depth):
+    return 8 * (HEADER_WORDS + n_instruments * slot_words(depth))
+
+
+class SharedMultiOrderBook(MultiOrderBook):
+    """MultiOrderBook that publishes its top-N levels into shared memory.
+
+    One ingest process owns the books and the segment. Strategy processes
+    attach a SharedOrderBookReader to the segment name and read prices
+    without any pickling or sockets of their own.
+    """
+
+    def __init__(
+        self,
+        instrument_keys=(1, 80, 82),
+        depth=5,
+        use_depth_limiter=True,
+        backend="sorted",
+        instrument_specs=None,
+        name=None,
+    ):
+        instrument_keys = tuple(instrument_keys)
+        self.shm = SharedMemory(
+            name=name, create=True, size=segment_size(len(instrument_keys), depth)
+        )
+        self.ints = self.shm.buf.cast("q")
+        self.floats = self.shm.buf.cast("d")
+        self.slot_offsets = {
+            _id: HEADER_WORDS + i * slot_words(depth)
+            for i, _id in enumerate(instrument_keys)
+        }
+
+        self.ints[HEADER_MAGIC] = MAGIC
+        self.ints[HEADER_INSTRUMENTS] = len(instrument_keys)
+        self.ints[HEADER_DEPTH] = depth
+        self.ints[HEADER_BATCH] = 0
+
+        super().__init__(
+            instrument_keys,
+            depth=depth,
+            use_depth_limiter=use_depth_limiter,
+            backend=backend,
+            instrument_specs=instrument_specs,
+        )
+        for _id in instrument_keys:
+            self.publish(_id)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def refresh_top_of_book(self, instrument_ids):
+        # Every applied batch, invalidation and clear ends up here with the
+        # instruments it touched, which makes it the one place to publish.
+        for _id in instrument_ids:
+            self.publish(_id)
+        self.ints[HEADER_BATCH] += 1
+        return super().refresh_top_of_book(instrument_ids)
+
+    def publish(self, instrument_id):
+        ints = self.ints
+        floats = self.floats
+        depth = self.depth
+        base = self.slot_offsets[instrument_id]
+        book = self.book[instrument_id]
+        bids = book.get_bids()
+        asks = book.get_asks()
+
+        ints[base] += 1  # Odd: readers retry until the slot is consistent
+        ints[base + 1] = int(instrument_id not in self.invalid_instruments)
+        ints[base + 2] = len(bids)
+        ints[base + 3] = len(asks)
+
+        bid_prices = base + SLOT_HEADER_WORDS
+        bid_quantities = bid_prices + depth
+        ask_prices = bid_quantities + depth
+        ask_quantities = ask_prices + depth
+        for i, (price, quantity) in enumerate(bids):
+            floats[bid_prices + i] = price
+            floats[bid_quantities + i] = quantity
+        for i, (price, quantity) in enumerate(asks):
+            floats[ask_prices + i] = price
+            floats[ask_quantities + i] = quantity
+
+        ints[base] += 1
+
+    def close(self):
+        self.ints.release()
+        self.floats.release()
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class SharedNDAXOrderbook(SharedMultiOrderBook, NDAXOrderbook):
+    pass
+
+
+class SharedOrderBookReader:
+    """Read-only view of a SharedMultiOrderBook segment from another process.
+
+    Indexes like a MultiOrderBook, so it can be handed to a triangle in place
+    of a normal book. Each read returns an immutable BookLevels capture.
+    """
+
+    def __init__(self, name, instrument_keys, track=True):
+        """__init__.
+
+        :param name: segment name of the writer's SharedMultiOrderBook
+        :param instrument_keys: instrument ids in the writer's order
+        :param track: keep the segment registered with the resource tracker.
+            Processes started by the writer with multiprocessing share its
+            tracker and must keep it. Pass False from an unrelated process,
+            whose own tracker would otherwise unlink the segment on exit.
+        """
+        self.shm = SharedMemory(name=name)
+        # Attaching registers the segment with this process' resource tracker.
+        # A shared tracker needs the registration for the writer's unlink().
+        if not track:
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        self.ints = self.shm.buf.cast("q")
+        self.floats = self.shm.buf.cast("d")
+
+        instrument_keys = tuple(instrument_keys)
+        if self.ints[HEADER_MAGIC] != MAGIC:
+            raise ValueError(f"{name} is not a shared order book segment")
+        if self.ints[HEADER_INSTRUMENTS] != len(instrument_keys):
+            raise ValueError(
+                f"Segment holds {self.ints[HEADER_INSTRUMENTS]} instruments, got {len(instrument_keys)} keys"
+            )
+
+        self.depth = self.ints[HEADER_DEPTH]
+        self.instrument_keys = instrument_keys
+        self.slot_offsets = {
+            _id: HEADER_WORDS + i * slot_words(self.depth)
+            for i, _id in enumerate(instrument_keys)
+        }
+
+    @property
+    def update_counter(self):
+        return self.ints[HEADER_BATCH]
+
+    def __getitem__(self, key):
+        return self.read(key)[0]
+
+    def read(self, instrument_id, depth=None):
+        """read.
+        Seqlock read of one instrument slot.
+
+        :returns: tuple of (BookLevels, valid flag)
+        :raises SeqlockTimeout: if the slot stays mid-publish for MAX_READ_ATTEMPTS reads
+        """
+        ints = self.ints
+        floats = self.floats
+        book_depth = self.depth
+        depth = book_depth if depth is None else min(depth, book_depth)
+        base = self.slot_offsets[instrument_id]
+        bid_prices = base + SLOT_HEADER_WORDS
+        bid_quantities = bid_prices + book_depth
+        ask_prices = bid_quantities + book_depth
+        ask_quantities = ask_prices + book_depth
+
+        for _ in range(MAX_READ_ATTEMPTS):
+            sequence = ints[base]
+            if sequence & 1:
+                continue
+
+            valid = bool(ints[base + 1])
+            n_bids = min(ints[base + 2], depth)
+            n_asks = min(ints[base + 3], depth)
+            bids = tuple(
+                zip(
+                    floats[bid_prices : bid_prices + n_bids].tolist(),
+                    floats[bid_quantities : bid_quantities + n_bids].tolist(),
+                )
+            )
+            asks = tuple(
+                zip(
+                    floats[ask_prices : ask_prices + n_asks].tolist(),
+                    floats[ask_quantities : ask_quantities + n_asks].tolist(),
+                )
+            )
+
+            if ints[base] == sequence:
+                return BookLevels(bids, asks, sequence >> 1), valid
+
+        raise SeqlockTimeout(
+            f"Slot of {instrument_id} still being written after {MAX_READ_ATTEMPTS} reads"
+        )
+
+    def is_valid(self, instrument_ids):
+        ints = self.ints
+        return all(ints[self.slot_offsets[_id] + 1] for _id in instrument_ids)
+
+    def capture(self, instrument_ids, depth=1, retries=3):
+        """capture.
+        Snapshot several instruments. Retries while the writer publishes a new
+        batch mid-capture, so the levels normally come from the same batch.
+        """
+        for _ in range(retries):
+            batch = self.ints[HEADER_BATCH]
+            levels = {_id: self.read(_id, depth)[0] for _id in instrument_ids}
+            if self.ints[HEADER_BATCH] == batch:
+                break
+        return BookSnapshot(levels)
+
+    def close(self):
+        self.ints.release()
+        self.floats.release()
+        self.shm.close()
@@ -0,0 +1,64 @@
+import re
+
+from hermes.utils.serialization import loads
+from hermes.utils.structures import NDAXMessage
+
+# NDAX frames are {"m": <type>, "i": <sequence>, "n": <function>, "o": "<json>"},
+# always in this key order, so the header can be read without parsing the frame.
+FRAME_HEADER_PATTERN = r'\s*\{\s*"m"\s*:\s*(\d+)\s*,\s*"i"\s*:\s*(\d+)\s*,\s*"n"\s*:\s*"([^"]*)"'
+FRAME_HEADER = re.compile(FRAME_HEADER_PATTERN)
+# Binary websocket frames arrive as bytes, which the JSON backends parse directly
+FRAME_HEADER_BYTES = re.compile(FRAME_HEADER_PATTERN.encode())
+
+
+# Frame types that answer a client request and carry its sequence number
+REPLY_TYPES = frozenset([1, 5])
+
+
+class NDAXDecoder:
+    """Lazy NDAX frame decoder.
+
+    Reads the function name from the frame header first and only parses the
+    frame and its "o" payload for functions in wanted, or for replies to a
+    sequence number in pending. Anything else comes back with just its header.
+    """
+
+    def __init__(self, wanted, pending=()):
+        self.wanted = wanted
+        self.pending = pending
+
+    def is_wanted(self, message_type, sequence, message_fn):
+        return message_fn in self.wanted or (
+            message_type in REPLY_TYPES and sequence in self.pending
+        )
+
+    def decode(self, raw_message):
+        """decode.
+
+        :param raw_message: raw json-encoded frame, str or bytes
+        :returns: NDAXMessage, with message and payload set to None for unwanted frames
+        :raises ValueError: if a frame that has to be parsed is malformed
+        """
+        if isinstance(raw_message, str):
+            header = FRAME_HEADER.match(raw_message)
+            message_fn = header and header.group(3)
+        else:
+            header = FRAME_HEADER_BYTES.match(raw_message)
+            message_fn = header and header.group(3).decode()
+        if header is not None:
+            message_type = int(header.group(1))
+            sequence = int(header.group(2))
+            if not self.is_wanted(message_type, sequence, message_fn):
+                return NDAXMessage(None, message_fn, None, message_type, sequence)
+            message = loads(raw_message)
+        else:  # Unusual key order, fall back to a full parse
+            message = loads(raw_message)
+            message_type = message["m"]
+            sequence = message["i"]
+            message_fn = message["n"]
+            if not self.is_wanted(message_type, sequence, message_fn):
+                return NDAXMessage(None, message_fn, None, message_type, sequence)
+
+        return NDAXMessage(
+            message, message_fn, loads(message["o"]), message_type, sequence
+        )
@@ -1,13 +1,24 @@
 import asyncio
-import json
 import logging
-from hermes.utils.synchronization import SingletonResetEvent
+from dataclasses import dataclass
+from time import perf_counter_ns
+from hermes.exchanges.ndax import (
+    create_subscribe_level2_req,
+    create_unsubscribe_level2_req,
+)
+from hermes.router.decoder import NDAXDecoder, REPLY_TYPES
+from hermes.utils.latency import LatencyTracer, STAGE_PARSE
+from hermes.utils.ratelimit import PRIORITY_SUBSCRIPTION
+from hermes.utils.serialization import loads
 from hermes.utils.structures import NDAXMessage
+from hermes.utils.synchronization import SingletonResetEvent
 
 BTCCAD_ID = 1
 BTCUSDT_ID = 82
 USDTCAD_ID = 80
 
+RESYNC_TIMEOUT = 10.0  # Seconds to wait for a resubscription's snapshot
+
 
 class UnhandledMessageException(Exception):
     pass
@@ -17,100 +28,339 @@ class ServerErrorMsg(Exception):
     pass
 
 
-class NDAXRouter:
-    ACCOUNT_EVENTS = [
-        "AccountPositionEvent",
-        "CancelAllOrdersRejectEvent",
-        "CancelOrderRejectEvent",
-        "CancelReplaceOrderRejectEvent",
-        "MarketStatusUpdate",
-        "NewOrderRejectEvent",
-        "OrderStateEvent",
-        "OrderTradeEvent",
-        "PendingDepositUpdate",
-    ]
+@dataclass
+class HandlerStats:
+    calls: int = 0
+    total_ns: int = 0
+    max_ns: int = 0
 
+    @property
+    def mean_ns(self):
+        return self.total_ns / self.calls if self.calls else 0.0
 
-    def __init__(self, session, account, orderbook, trader):
-        self.account = account
-        self.session = session
-        self.orderbook = orderbook
-        self.trader = trader
+
+def deferred_stats_key(message_fn):
+    # Deferred passes time strategies rather than book updates, keep them apart
+    return f"{message_fn}:deferred"
+
+
+class MessageRouter:
+    """Dispatches decoded messages to handlers registered by function name.
+
+    Components register their own handlers with register(). Handlers for the
+    same function run in registration order and receive the message payload.
+    Deferred handlers run once per routed batch instead of once per message,
+    after every message in the batch has been dispatched. Exchange routers
+    only need to implement parse_message_safely.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.deferred_handlers = {}
+        self.handler_stats = {}
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.reset_event = SingletonResetEvent.instance()
+
+    def register(self, message_fn, handler, deferred=False):
+        # Deferred-only functions still get an entry, so their payloads are parsed
+        self.handlers.setdefault(message_fn, [])
+        if deferred:
+            self.deferred_handlers.setdefault(message_fn, []).append(handler)
+            self.handler_stats.setdefault(deferred_stats_key(message_fn), HandlerStats())
+        else:
+            self.handlers[message_fn].append(handler)
+            self.handler_stats.setdefault(message_fn, HandlerStats())
 
     async def route(self, raw_message):
-        message = self.parse_message_safely(raw_message)
-        if not message:
+        await self.route_batch((raw_message,))
+
+    async def route_batch(self, raw_messages):
+        """route_batch.
+        Dispatch every message in order, then run the deferred handlers once
+        for each function that appeared, with the latest payload.
+
+        :param raw_messages: iterable of raw messages
+        """
+        deferred = {}
+        for raw_message in raw_messages:
+            message = self.parse_message_safely(raw_message)
+            if not message:
+                continue
+
+            await self.dispatch(message)
+            if message.message_fn in self.deferred_handlers:
+                deferred[message.message_fn] = message
+
+        for message_fn, message in deferred.items():
+            await self.run_handlers(
+                deferred_stats_key(message_fn),
+                self.deferred_handlers[message_fn],
+                message.payload,
+            )
+
+    async def dispatch(self, message):
+        handlers = self.handlers.get(message.message_fn)
+        if not handlers:
+            if message.message_fn not in self.deferred_handlers:
+                self.handle_unregistered(message)
             return
 
-        message_fn = message.message_fn
-        payload = message.payload
+        await self.run_handlers(message.message_fn, handlers, message.payload)
 
-        if message_fn == "SubscribeLevel2":  # Should update order book
-            self.logger.info("Subscription Message Received")
-            await self.orderbook.update(payload)
+    async def run_handlers(self, stats_key, handlers, payload):
+        start = perf_counter_ns()
+        for handler in handlers:
+            await handler(payload)
+        elapsed = perf_counter_ns() - start
 
-        elif message_fn == "Level2UpdateEvent":
-            await self.orderbook.update(payload)
-            await self.trader.recheck_orderbook_and_trade()
+        stats = self.handler_stats[stats_key]
+        stats.calls += 1
+        stats.total_ns += elapsed
+        if elapsed > stats.max_ns:
+            stats.max_ns = elapsed
 
-        elif message_fn == "GetAccountPositions":
-            await self.account.process_account_positions(payload)
+    def handle_unregistered(self, message):
+        self.logger.error(f"Unhandled message. Not stopping op: {message.message_fn}")
 
-        elif message_fn == "OrderTradeEvent":  # Trade confirmation
-            await self.trader.handle_trade_event(payload)
+    def log_handler_stats(self):
+        for message_fn, stats in self.handler_stats.items():
+            if stats.calls:
+                self.logger.info(
+                    f"{message_fn}: {stats.calls} calls, mean {stats.mean_ns / 1000:.1f}us, max {stats.max_ns / 1000:.1f}us"
+                )
 
-        elif message_fn == "OrderStateEvent":
-            await self.trader.handle_state_change_event(payload)
+    def parse_message_safely(self, raw_message):
+        raise NotImplementedError("Please use a child class")
 
-        elif message_fn == "SubscribeAccountEvents":
-            if not payload["Subscribed"]:
-                raise ServerErrorMsg("Subscription to Account Events Failed")
-            else:
-                self.logger.info("Account Events Successfully Subscribed")
 
-        elif message_fn == "DepositTicketUpdateEvent":
-            self.logger.info(f"Deposit Ticket Event: {payload}")
+class NDAXRouter(MessageRouter):
+    ACCOUNT_EVENTS = frozenset(
+        [
+            "AccountPositionEvent",
+            "CancelAllOrdersRejectEvent",
+            "CancelOrderRejectEvent",
+            "CancelReplaceOrderRejectEvent",
+            "MarketStatusUpdate",
+            "NewOrderRejectEvent",
+            "OrderStateEvent",
+            "OrderTradeEvent",
+            "PendingDepositUpdate",
+        ]
+    )
 
-        elif message_fn == "SendOrder":
-            self.logger.info(f"SendOrder Response: {message}")
+    def __init__(self, session, account, orderbook, trader):
+        super().__init__()
+        self.account = account
+        self.session = session
+        self.orderbook = orderbook
+        self.trader = trader
+        self.reset_event = SingletonResetEvent.instance()
+        self.tracer = LatencyTracer.instance()
+        self.resubscriptions = {}  # instrument id -> task
 
-        elif message_fn == 'NewOrderRejectEvent':
-            self.logger.error(f'Order Rejected: {message}')
+        # Only payloads of registered functions and awaited replies get parsed
+        self.decoder = NDAXDecoder(self.handlers, session.pending_requests)
 
-        elif message_fn in NDAXRouter.ACCOUNT_EVENTS:
+        # Registration order is dispatch order: the book applies an update
+        # before the router resyncs gaps and before the trader re-evaluates.
+        orderbook.register_handlers(self)
+        self.register("SubscribeLevel2", self.log_subscription)
+        self.register("Level2UpdateEvent", self.resync_invalid_books)
+        self.register("UnSubscribeLevel2", self.log_unsubscribe)
+        self.register("SubscribeAccountEvents", self.check_account_subscription)
+        self.register("DepositTicketUpdateEvent", self.log_deposit_ticket)
+        self.register("SendOrder", self.log_send_order)
+        self.register("NewOrderRejectEvent", self.log_order_rejected)
+        account.register_handlers(self)
+        trader.register_handlers(self)
+
+    async def dispatch(self, message):
+        # Replies to session.request() resolve after the handlers have run, so
+        # the awaiting caller sees the state the reply produced.
+        awaited = (
+            message.message_type in REPLY_TYPES
+            and message.sequence in self.session.pending_requests
+        )
+        if not awaited or message.message_fn in self.handlers:
+            await super().dispatch(message)
+        if awaited:
+            self.session.resolve_request(message)
+
+    def handle_unregistered(self, message):
+        if message.message_fn in NDAXRouter.ACCOUNT_EVENTS:
             self.logger.warning(
-                f"Unhandled account message. Not stopping op: {message_fn}"
+                f"Unhandled account message. Not stopping op: {message.message_fn}"
             )
-
         else:
+            super().handle_unregistered(message)
+
+    async def resync_invalid_books(self, payload):
+        # Sequence gaps only invalidate the affected books
+        resync = self.orderbook.pop_resync_requests()
+        if resync:
+            self.schedule_resubscribe(resync)
+
+    def schedule_resubscribe(self, instrument_ids):
+        # Sends wait for rate limit budget, which must never stall processing,
+        # so each resubscription runs as its own task
+        for instrument_id in instrument_ids:
+            if instrument_id in self.resubscriptions:
+                continue
+            task = asyncio.ensure_future(self.resubscribe(instrument_id))
+            self.resubscriptions[instrument_id] = task
+            task.add_done_callback(
+                lambda task, _id=instrument_id: self.resubscribe_done(_id, task)
+            )
+
+    def resubscribe_done(self, instrument_id, task):
+        if self.resubscriptions.get(instrument_id) is task:
+            del self.resubscriptions[instrument_id]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
             self.logger.error(
-                f"Unhandled account message. Not stopping op: {message_fn}"
+                f"Resubscribing to {instrument_id} failed: {task.exception()}"
+            )
+        # Timed out requests are queued again. Retry without waiting for the
+        # next book update, which may never come if every book is invalid.
+        resync = self.orderbook.pop_resync_requests()
+        if resync:
+            self.schedule_resubscribe(resync)
+
+    def cancel_resubscriptions(self):
+        for task in self.resubscriptions.values():
+            task.cancel()
+        self.resubscriptions = {}
+
+    async def resubscribe(self, instrument_id):
+        self.logger.warning(f"Resubscribing to Level2 for {instrument_id}")
+        await self.session.send_market_data(
+            create_unsubscribe_level2_req(instrument_id),
+            priority=PRIORITY_SUBSCRIPTION,
+        )
+        try:
+            # The reply is the snapshot, applied by the handlers before this resumes
+            await self.session.request(
+                "SubscribeLevel2",
+                {"OMSId": 1, "InstrumentId": instrument_id, "Depth": self.orderbook.depth},
+                timeout=RESYNC_TIMEOUT,
+                priority=PRIORITY_SUBSCRIPTION,
+                market_data=True,
             )
+        except asyncio.TimeoutError:
+            self.logger.warning(f"No Level2 snapshot for {instrument_id}, retrying")
+            self.orderbook.request_resync(instrument_id)
+            return
+        # An empty snapshot has no rows to mark the book valid
+        self.orderbook.mark_synced(instrument_id)
+
+    async def log_subscription(self, payload):
+        self.logger.info("Subscription Message Received")
+
+    async def log_unsubscribe(self, payload):
+        self.logger.info(f"Unsubscribed from Level2: {payload}")
+
+    async def check_account_subscription(self, payload):
+        if not payload["Subscribed"]:
+            raise ServerErrorMsg("Subscription to Account Events Failed")
+        else:
+            self.logger.info("Account Events Successfully Subscribed")
+
+    async def log_deposit_ticket(self, payload):
+        self.logger.info(f"Deposit Ticket Event: {payload}")
+
+    async def log_send_order(self, payload):
+        self.logger.info(f"SendOrder Response: {payload}")
+
+    async def log_order_rejected(self, payload):
+        self.logger.error(f'Order Rejected: {payload}')
 
     def parse_message_safely(self, raw_message):
         """parse_message_safely.
-        If the message can be parsed, parse it and return
+        If the message can be parsed, parse it and return. Payloads are only
+        parsed for messages with a registered handler.
 
         :param raw_message: raw json-encoded bytes message
         """
+        start = perf_counter_ns() if self.tracer.enabled else 0
         try:
-            message = json.loads(raw_message)
-
-            message_fn = message["n"]
-            payload = json.loads(message["o"])
-            return NDAXMessage(message, message_fn, payload)
-        except json.decoder.JSONDecodeError as e:
+            message = self.decoder.decode(raw_message)
+        except ValueError as e:
             self.logger.error(f'Json Decode Error on message: {raw_message}. Requesting reset.')
             self.reset_event.set()
             return None
 
-class KrakenRouter:
+        if start:
+            self.tracer.record(STAGE_PARSE, start)
+        return message
+
+
+class NDAXMarketDataRouter(MessageRouter):
+    """Routes an unauthenticated NDAX market data connection into a book.
+
+    For processes that only need NDAX prices, without the account and trader
+    an NDAXRouter wires up.
+    """
+
+    def __init__(self, connection, orderbook):
+        super().__init__()
+        self.connection = connection
+        self.orderbook = orderbook
+        self.decoder = NDAXDecoder(self.handlers)
+
+        orderbook.register_handlers(self)
+        self.register("Level2UpdateEvent", self.resync_invalid_books)
+
+    async def resync_invalid_books(self, payload):
+        for instrument_id in self.orderbook.pop_resync_requests():
+            self.logger.warning(f"Resubscribing to Level2 for {instrument_id}")
+            await self.connection.send(create_unsubscribe_level2_req(instrument_id))
+            await self.connection.send(
+                create_subscribe_level2_req(instrument_id, depth=self.orderbook.depth)
+            )
 
+    def handle_unregistered(self, message):
+        self.logger.debug(f"Unhandled NDAX message: {message.message_fn}")
+
+    def parse_message_safely(self, raw_message):
+        try:
+            return self.decoder.decode(raw_message)
+        except ValueError:
+            self.logger.error(f"Json Decode Error on message: {raw_message}")
+            return None
+
+
+class KrakenRouter(MessageRouter):
     def __init__(self, session, account, orderbook, trader):
-        pass
+        super().__init__()
+        self.session = session
+        self.account = account
+        self.orderbook = orderbook
+        self.trader = trader
 
+        for component in (orderbook, account, trader):
+            if component is not None:
+                component.register_handlers(self)
 
-    def is_message_l2(self, message):
-        pass
+    def handle_unregistered(self, message):
+        # heartbeat, systemStatus, subscriptionStatus...
+        self.logger.debug(f"Unhandled Kraken message: {message.message_fn}")
+
+    def parse_message_safely(self, raw_message):
+        """parse_message_safely.
+        Kraken sends channel data as lists ending in [channel name, pair] and
+        everything else as event dicts. Channel data is routed by channel type,
+        e.g. "book-10" -> "book", events by their event name.
+
+        :param raw_message: raw json-encoded message
+        """
+        try:
+            message = loads(raw_message)
+        except ValueError:
+            self.logger.error(f"Json Decode Error on message: {raw_message}")
+            return None
+
+        if isinstance(message, list):
+            message_fn = message[-2].split("-")[0]
+        else:
+            message_fn = message.get("event")
+        return NDAXMessage(message, message_fn, message)
@@ -0,0 +1,130 @@
+import logging
+from collections import namedtuple
+from itertools import permutations
+from math import inf
+from time import monotonic
+from typing import Tuple
+
+from hermes.strategies.arbitrage.triangle import (
+    SIDE_BUY,
+    SIDE_SELL,
+    ORDER_TYPE_MARKET,
+)
+from hermes.utils.structures import Order
+
+# Best cross-venue trade: buy at ask on buy_venue, sell at bid on sell_venue.
+# edge is the fractional gain net of both venues' fees, quantity the base
+# quantity both L1 levels can fill.
+CrossEdge = namedtuple(
+    "CrossEdge",
+    ["edge", "buy_venue", "sell_venue", "ask_price", "bid_price", "quantity"],
+)
+
+
+class CrossVenueArbitrage:
+    """Buy on one venue and sell the same instrument on another.
+
+    Holds the MultiOrderBook of every venue and the id of the instrument on
+    each. Assumes inventory on both venues, so the two legs go out together
+    with the same quantity. The edge of buying at A's ask and selling at B's
+    bid is bid_B * (1 - fee_B) / (ask_A * (1 + fee_A)) - 1.
+
+    Venues whose book is invalid or has not been updated in the last max_age
+    seconds are left out, so the strategy never acts on a stale quote.
+    """
+
+    def __init__(self, books, instrument_ids, fees, max_age=2.0):
+        """__init__.
+
+        :param books: {venue: MultiOrderBook}
+        :param instrument_ids: {venue: id of the instrument on that venue}
+        :param fees: {venue: taker fee}
+        :param max_age: seconds since a venue's last update before it counts as stale
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.books = books
+        self.instrument_ids = instrument_ids
+        self.fees = fees
+        self.max_age = max_age
+        self.venue_pairs = tuple(permutations(instrument_ids, 2))
+
+    def is_affected(self, venue, changed_instruments):
+        return self.instrument_ids.get(venue) in changed_instruments
+
+    def live_venues(self, now=None):
+        if now is None:
+            now = monotonic()
+        live = set()
+        for venue, _id in self.instrument_ids.items():
+            book = self.books[venue]
+            if book.is_valid((_id,)) and book.is_fresh((_id,), self.max_age, now):
+                live.add(venue)
+        return live
+
+    def best_edge(self, now=None):
+        """best_edge.
+
+        :returns: CrossEdge with the highest edge among live venue pairs, or None
+        """
+        live = self.live_venues(now)
+        best = None
+        for buy_venue, sell_venue in self.venue_pairs:
+            if buy_venue not in live or sell_venue not in live:
+                continue
+            try:
+                ask_book = self.books[buy_venue][self.instrument_ids[buy_venue]]
+                bid_book = self.books[sell_venue][self.instrument_ids[sell_venue]]
+                ask_price = ask_book.best_ask_price()
+                bid_price = bid_book.best_bid_price()
+                quantity = min(ask_book.best_ask_quantity(), bid_book.best_bid_quantity())
+            except IndexError:  # Empty side
+                continue
+
+            edge = (
+                bid_price
+                * (1 - self.fees[sell_venue])
+                / (ask_price * (1 + self.fees[buy_venue]))
+                - 1
+            )
+            if best is None or edge > best.edge:
+                best = CrossEdge(edge, buy_venue, sell_venue, ask_price, bid_price, quantity)
+        return best
+
+    def net(self, cash_available, edge=None):
+        """net.
+        Profit in quote currency of trading the best edge, capped by cash and L1.
+        """
+        edge = edge or self.best_edge()
+        if edge is None:
+            return -inf
+        quantity = min(edge.quantity, cash_available / edge.ask_price)
+        return edge.edge * quantity * edge.ask_price * (1 + self.fees[edge.buy_venue])
+
+    def get_orders(self, cash_available, edge=None) -> Tuple[Order]:
+        """get_orders.
+
+        :returns: (buy order, sell order), each tagged with its venue, or None
+        """
+        edge = edge or self.best_edge()
+        if edge is None:
+            return None
+
+        quantity = min(edge.quantity, cash_available / edge.ask_price)
+        return (
+            Order(
+                instrument_id=self.instrument_ids[edge.buy_venue],
+                side=SIDE_BUY,
+                quantity=quantity,
+                order_type=ORDER_TYPE_MARKET,
+                expected_price=edge.ask_price,
+                venue=edge.buy_venue,
+            ),
+            Order(
+                instrument_id=self.instrument_ids[edge.sell_venue],
+                side=SIDE_SELL,
+                quantity=quantity,
+                order_type=ORDER_TYPE_MARKET,
+                expected_price=edge.bid_price,
+                venue=edge.sell_venue,
+            ),
+        )
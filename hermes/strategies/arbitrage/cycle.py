@@ -0,0 +1,284 @@
+import logging
+from collections import namedtuple
+from copy import copy
+from math import exp, inf, log
+from typing import Tuple
+
+import numpy as np
+
+from hermes.strategies.arbitrage.triangle import (
+    SIDE_BUY,
+    SIDE_SELL,
+    ORDER_TYPE_MARKET,
+)
+from hermes.utils.structures import Order
+
+# One conversion of a cycle: spend from_asset on instrument_id, receive to_asset.
+# price is the L1 price crossed, capacity the L1 quantity (base units).
+CycleLeg = namedtuple(
+    "CycleLeg", ["instrument_id", "side", "price", "capacity", "from_asset", "to_asset"]
+)
+
+
+class CycleArbitrage:
+    """N-leg cycle arbitrage over every asset of a MultiOrderBook.
+
+    Keeps a matrix of log conversion rates between assets, net of fees: buying
+    base with quote at the ask is the quote -> base edge, selling base at the
+    bid is the base -> quote edge. Only the instruments whose top of book
+    version moved since the last refresh are rewritten.
+
+    The search is a max-plus Bellman-Ford from the cash asset, vectorized over
+    all assets, that finds the most profitable cycle of up to max_length legs
+    back to cash. A length whose best walk revisits an asset is skipped.
+
+    Offers the TriangleL1 interface so NDAXMarketTriangleTrader can trade it.
+    The best cycle is the forward direction. Cycles are searched in both
+    orientations, so backward never has an opportunity.
+    """
+
+    def __init__(
+        self, orderbook, instrument_assets, cash_asset, fee=0.002, max_length=4
+    ):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.orderbook = orderbook
+        self.instrument_ids = tuple(instrument_assets)
+        self.cash_asset = cash_asset
+        self.max_length = max_length
+        self.adjusted_single_trade_value = 1 - fee
+        self.log_fee = log(1 - fee)
+
+        self.assets = sorted(
+            {asset for pair in instrument_assets.values() for asset in pair}
+        )
+        asset_index = {asset: i for i, asset in enumerate(self.assets)}
+        self.cash_index = asset_index[cash_asset]
+        self.edges = {
+            _id: (asset_index[base], asset_index[quote])
+            for _id, (base, quote) in instrument_assets.items()
+        }
+
+        n = len(self.assets)
+        self.log_rates = np.full((n, n), -inf)
+        self.prices = np.zeros((n, n))
+        self.capacities = np.zeros((n, n))
+        self.edge_instruments = {}  # (from, to) -> (instrument id, side)
+        for _id, (base, quote) in self.edges.items():
+            self.edge_instruments[(quote, base)] = (_id, SIDE_BUY)
+            self.edge_instruments[(base, quote)] = (_id, SIDE_SELL)
+        self.versions = {}
+        self.best = None
+
+    def on(self, orderbook):
+        """Return a copy of this strategy that reads from another book."""
+        strategy = copy(self)
+        strategy.orderbook = orderbook
+        strategy.log_rates = self.log_rates.copy()
+        strategy.prices = self.prices.copy()
+        strategy.capacities = self.capacities.copy()
+        strategy.versions = {}
+        strategy.best = None
+        return strategy
+
+    def capture(self, depth=1):
+        """Refresh from the book and return a copy holding the best cycle found."""
+        self.refresh()
+        strategy = copy(self)
+        strategy.best = self.search()
+        return strategy
+
+    def crossed(self, changed_instruments) -> bool:
+        # No per-leg trigger for a cycle search, always evaluate
+        return True
+
+    def refresh(self):
+        """refresh.
+        Rewrite the matrix entries of instruments whose top of book moved.
+        Books without top of book tracking, such as snapshots and shared
+        memory readers, are read through their best_* methods instead, and
+        without versions every instrument is rewritten.
+
+        :returns: number of instruments updated
+        """
+        orderbook = self.orderbook
+        versions = getattr(orderbook, "top_of_book_version", None)
+        if versions is None:
+            versions = getattr(orderbook, "versions", None)
+        top_of_book = getattr(orderbook, "top_of_book", None)
+
+        updated = 0
+        for _id, (base, quote) in self.edges.items():
+            if versions is not None:
+                version = versions[_id]
+                if self.versions.get(_id) == version:
+                    continue
+                self.versions[_id] = version
+            updated += 1
+
+            book = orderbook[_id]
+            if top_of_book is not None:
+                bid_price, bid_qty, ask_price, ask_qty = top_of_book[_id]
+                if ask_price:
+                    ask_price /= book.price_scale
+                    ask_qty /= book.quantity_scale
+                if bid_price:
+                    bid_price /= book.price_scale
+                    bid_qty /= book.quantity_scale
+            else:
+                bid_price, bid_qty, ask_price, ask_qty = self._read_top(book)
+            self._set_edge(quote, base, ask_price, ask_qty, buy=True)
+            self._set_edge(base, quote, bid_price, bid_qty, buy=False)
+        return updated
+
+    @staticmethod
+    def _read_top(book):
+        # Empty sides read as 0, like top_of_book
+        try:
+            bid = book.best_bid_price(), book.best_bid_quantity()
+        except IndexError:
+            bid = 0, 0
+        try:
+            ask = book.best_ask_price(), book.best_ask_quantity()
+        except IndexError:
+            ask = 0, 0
+        return bid + ask
+
+    def _set_edge(self, from_asset, to_asset, price, quantity, buy):
+        if not price:
+            self.log_rates[from_asset, to_asset] = -inf
+            return
+        rate = -log(price) if buy else log(price)
+        self.log_rates[from_asset, to_asset] = self.log_fee + rate
+        self.prices[from_asset, to_asset] = price
+        self.capacities[from_asset, to_asset] = quantity
+
+    def search(self):
+        """search.
+        Max-plus Bellman-Ford from cash: after k steps, value[v] is the best
+        log amount of v obtainable from one unit of cash in k conversions.
+
+        :returns: (log multiplier, legs) of the best simple cycle, or None
+        """
+        log_rates = self.log_rates
+        cash = self.cash_index
+        n = len(self.assets)
+        columns = np.arange(n)
+
+        value = np.full(n, -inf)
+        value[cash] = 0.0
+        parents = []
+        best = None
+        for length in range(1, self.max_length + 1):
+            candidates = value[:, None] + log_rates
+            parent = candidates.argmax(axis=0)
+            value = candidates[parent, columns]
+            parents.append(parent)
+
+            if length < 2 or value[cash] == -inf:
+                continue
+            if best is not None and value[cash] <= best[0]:
+                continue
+            path = self._trace(parents, cash)
+            if path is not None:
+                best = (float(value[cash]), path)
+
+        if best is None:
+            return None
+        log_value, path = best
+        return log_value, self._legs(path)
+
+    @staticmethod
+    def _trace(parents, end):
+        # Walk the parent pointers back from end, rejecting repeated assets
+        path = [end]
+        for parent in reversed(parents):
+            path.append(int(parent[path[-1]]))
+        path.reverse()
+        if len(set(path[:-1])) != len(path) - 1:
+            return None
+        return path
+
+    def _legs(self, path):
+        legs = []
+        for a, b in zip(path, path[1:]):
+            instrument_id, side = self.edge_instruments[(a, b)]
+            legs.append(
+                CycleLeg(
+                    instrument_id,
+                    side,
+                    float(self.prices[a, b]),
+                    float(self.capacities[a, b]),
+                    self.assets[a],
+                    self.assets[b],
+                )
+            )
+        return tuple(legs)
+
+    def _best(self):
+        if self.best is None:
+            self.refresh()
+            self.best = self.search()
+        return self.best
+
+    def forward(self) -> float:
+        best = self._best()
+        return exp(best[0]) if best else 0.0
+
+    def forward_net(self, cash_available: float) -> float:
+        best = self._best()
+        if best is None:
+            return -inf
+        return (exp(best[0]) - 1) * self._cash_throughput(best[1], cash_available)
+
+    def get_forward_orders(self, cash_available: float) -> Tuple[Order]:
+        best = self._best()
+        if best is None:
+            return None
+
+        fee_adjustment = self.adjusted_single_trade_value
+        amount = self._cash_throughput(best[1], cash_available)
+        orders = []
+        for leg in best[1]:
+            # Buys are sized in base bought with amount quote, sells in base sold
+            quantity = amount / leg.price if leg.side == SIDE_BUY else amount
+            orders.append(
+                Order(
+                    instrument_id=leg.instrument_id,
+                    side=leg.side,
+                    quantity=quantity,
+                    order_type=ORDER_TYPE_MARKET,
+                    expected_price=leg.price,
+                )
+            )
+            amount = (
+                quantity * fee_adjustment
+                if leg.side == SIDE_BUY
+                else quantity * leg.price * fee_adjustment
+            )
+        return tuple(orders)
+
+    def backward(self) -> float:
+        return 0.0
+
+    def backward_net(self, cash_available: float) -> float:
+        return -inf
+
+    def get_backward_orders(self, cash_available: float) -> Tuple[Order]:
+        return None
+
+    def _cash_throughput(self, legs, cash_available):
+        # Each leg can take at most its L1 quantity. Convert every limit back
+        # to the cash it corresponds to at the start of the cycle.
+        fee_adjustment = self.adjusted_single_trade_value
+        current_best = cash_available
+        rate = 1.0  # units of the leg's from_asset per unit of cash
+        for leg in legs:
+            if leg.side == SIDE_BUY:
+                limit = leg.capacity * leg.price / rate
+                rate = rate / leg.price * fee_adjustment
+            else:
+                limit = leg.capacity / rate
+                rate = rate * leg.price * fee_adjustment
+            if limit < current_best:
+                current_best = limit
+        return current_best
@@ -0,0 +1,105 @@
+from collections import defaultdict
+from itertools import combinations
+
+from hermes.strategies.arbitrage.triangle import (
+    TriangleEngine,
+    SIDE_BUY,
+    SIDE_SELL,
+)
+
+
+def find_cycles(instrument_assets):
+    """find_cycles.
+    Enumerate every triangular cycle in the currency graph, where assets are
+    nodes and instruments are edges.
+
+    :param instrument_assets: {instrument_id: (base asset, quote asset)}
+    :returns: list of (assets, instrument ids) per cycle. Both are sorted by asset,
+        and the instrument ids join assets (0, 1), (0, 2) and (1, 2).
+    """
+    edges = defaultdict(dict)  # asset -> {neighbour asset: instrument id}
+    for instrument_id, (base, quote) in instrument_assets.items():
+        edges[base][quote] = instrument_id
+        edges[quote][base] = instrument_id
+
+    cycles = []
+    for a in sorted(edges):
+        for b, c in combinations(sorted(n for n in edges[a] if n > a), 2):
+            if c in edges[b]:
+                cycles.append(((a, b, c), (edges[a][b], edges[a][c], edges[b][c])))
+    return cycles
+
+
+class TriangleIndex:
+    """Triangles over a set of instruments, indexed by the instruments they trade.
+
+    affected() returns only the triangles that contain a changed instrument,
+    so the evaluation cost of an update is proportional to what changed rather
+    than to the number of pairs watched.
+    """
+
+    def __init__(self, triangles):
+        self.triangles = list(triangles)
+        self.by_instrument = defaultdict(list)
+        for triangle in self.triangles:
+            for instrument_id in triangle.instrument_ids:
+                self.by_instrument[instrument_id].append(triangle)
+
+    def __len__(self):
+        return len(self.triangles)
+
+    def __iter__(self):
+        return iter(self.triangles)
+
+    def affected(self, changed_instruments):
+        """affected.
+
+        :param changed_instruments: iterable of instrument ids
+        :returns: list of the triangles trading any of them, each listed once
+        """
+        by_instrument = self.by_instrument
+        seen = set()
+        affected = []
+        for instrument_id in changed_instruments:
+            for triangle in by_instrument.get(instrument_id, ()):
+                if id(triangle) not in seen:
+                    seen.add(id(triangle))
+                    affected.append(triangle)
+        return affected
+
+    @classmethod
+    def discover(cls, orderbook, instrument_assets, cash_asset, fee=0.002):
+        """discover.
+        Build a triangle for every cycle through cash_asset, in any orientation.
+
+        The forward cycle goes cash -> X -> Y -> cash, where X is the base of
+        the X/Y pair. Each leg buys when it spends the pair's quote asset and
+        sells when it spends the base. X/cash, X/Y, Y/cash comes out as
+        buy-sell-sell, and pairs with cash as the base work the same way.
+
+        :param orderbook: book the triangles read from
+        :param instrument_assets: {instrument_id: (base asset, quote asset)}
+        :param cash_asset: asset every triangle starts and ends in
+        :param fee: taker fee per leg
+        """
+        triangles = []
+        for assets, instrument_ids in find_cycles(instrument_assets):
+            if cash_asset not in assets:
+                continue
+
+            pairs = {frozenset(instrument_assets[_id]): _id for _id in instrument_ids}
+            x, y = (asset for asset in assets if asset != cash_asset)
+            if instrument_assets[pairs[frozenset((x, y))]][0] != x:
+                x, y = y, x
+
+            ids = []
+            sides = []
+            for spend, receive in ((cash_asset, x), (x, y), (y, cash_asset)):
+                _id = pairs[frozenset((spend, receive))]
+                ids.append(_id)
+                sides.append(SIDE_BUY if instrument_assets[_id][1] == spend else SIDE_SELL)
+
+            triangles.append(
+                TriangleEngine(orderbook, instrument_ids=ids, fee=fee, sides=sides)
+            )
+        return cls(triangles)
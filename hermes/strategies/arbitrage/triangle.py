@@ -2,25 +2,91 @@ import logging
 import asyncio
 from abc import ABC, abstractmethod
 from collections import namedtuple
+from copy import copy
+from math import nan
 from hermes.exchanges.ndax import BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID
 from hermes.utils.structures import Order
 from typing import Tuple
-from functools import lru_cache
 
 SIDE_BUY = 0
 SIDE_SELL = 1
 
 ORDER_TYPE_MARKET = 1
 
+FORWARD = 0
+BACKWARD = 1
+
+# L1 price and quantity of an empty book side. Any rate through nan is nan,
+# so a direction that crosses it never compares as profitable.
+EMPTY_SIDE = (nan, 0.0)
+
+SIDES_BSS = (SIDE_BUY, SIDE_SELL, SIDE_SELL)
+SIDES_BBS = (SIDE_BUY, SIDE_BUY, SIDE_SELL)
+
 class TriangleL1(ABC):
 
     def __init__(self, orderbook, instrument_ids=[BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID], fee=0.002):
         self.adjusted_single_trade_value = 1 - fee
         self.triangle_value_multiplier = (1 - fee) ** 3
 
+        self.instrument_ids = tuple(instrument_ids)
         self.instrument_1, self.instrument_2, self.instrument_3 = instrument_ids
         self.orderbook = orderbook
 
+        # L1 cache, only kept on copies from on(), which read immutable snapshots
+        self._l1 = None
+        self._cache_l1 = False
+
+    def on(self, orderbook):
+        """Return a copy of this triangle that reads from another book, such as a snapshot."""
+        triangle = copy(self)
+        triangle.orderbook = orderbook
+        triangle._l1 = None
+        triangle._cache_l1 = True
+        return triangle
+
+    def l1(self):
+        """l1.
+        Best ask price and quantity, then best bid price and quantity, for each
+        of the three instruments in order. Read once per captured copy, and on
+        every call from a live book.
+
+        An empty side reads as a nan price and a 0 quantity, so only the
+        directions that cross it come out unprofitable.
+        """
+        l1 = self._l1
+        if l1 is None:
+            l1 = []
+            orderbook = self.orderbook
+            for _id in self.instrument_ids:
+                book = orderbook[_id]
+                try:
+                    l1.append(book.best_ask_price())
+                    l1.append(book.best_ask_quantity())
+                except IndexError:
+                    l1 += EMPTY_SIDE
+                try:
+                    l1.append(book.best_bid_price())
+                    l1.append(book.best_bid_quantity())
+                except IndexError:
+                    l1 += EMPTY_SIDE
+            l1 = tuple(l1)
+            if self._cache_l1:
+                self._l1 = l1
+        return l1
+
+    def capture(self, depth=1):
+        """Return a copy of this triangle bound to a consistent snapshot of its books."""
+        return self.on(self.orderbook.capture(self.instrument_ids, depth=depth))
+
+    def crossed(self, changed_instruments) -> bool:
+        """crossed.
+        Cheap pre-check before a full evaluation. False only when neither
+        direction can be profitable after changed_instruments moved.
+        Subclasses without a faster test always evaluate.
+        """
+        return True
+
     @abstractmethod
     def forward(self)-> float:
         pass
@@ -45,207 +111,381 @@ class TriangleL1(ABC):
     def get_backward_orders(self, cash_available: float) -> Tuple[Order]:
         pass
 
-class TriangleBSS(TriangleL1): # Forward requires Buy - Sell - Sell
+# A compiled leg: which L1 entries it crosses and how they enter the formulas.
+# Buys cross the ask and convert at 1 / price, sells cross the bid and convert
+# at price, so rate_exponent is -1 or 1. input_exponent is 1 for buys, whose
+# input is quote (quantity * price), and 0 for sells, whose input is base.
+TriangleLeg = namedtuple(
+    "TriangleLeg",
+    [
+        "instrument_id",
+        "side",
+        "price_index",
+        "quantity_index",
+        "rate_exponent",
+        "input_exponent",
+    ],
+)
+
+
+def compile_legs(instrument_ids, sides, l1_positions):
+    """compile_legs.
+
+    :param instrument_ids: instruments in trading order
+    :param sides: SIDE_BUY or SIDE_SELL per leg
+    :param l1_positions: position of each instrument in TriangleL1.l1()
+    """
+    return tuple(
+        TriangleLeg(
+            _id,
+            side,
+            4 * l1_positions[_id] + 2 * side,
+            4 * l1_positions[_id] + 2 * side + 1,
+            2 * side - 1,
+            1 - side,
+        )
+        for _id, side in zip(instrument_ids, sides)
+    )
+
+
+class TriangleEngine(TriangleL1):
+    """Triangle with any buy/sell direction per leg.
+
+    The forward cycle trades the instruments in order with the given sides.
+    The backward cycle trades them in reverse with every side flipped. Both
+    are compiled once into L1 indices and exponents, so the rate product,
+    throughput bottleneck and order sizes are the same loop for every
+    orientation, with no branching on side.
+
+    A direction is profitable when f^3 * prod(price_k ** e_k) > 1. With the
+    other two legs fixed, that holds exactly when leg k's price crosses
+    (f^3 * prod_{j != k} price_j ** e_j) ** -e_k, above it for sells and
+    below it for buys. crossed() keeps these trigger prices per leg and
+    direction, recomputes one only after another leg's price moved, and
+    compares the moved instrument's prices against its own triggers.
+    """
+
+    SIDES = None
+
+    def __init__(self, orderbook, instrument_ids=[BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID], fee=0.002, sides=None):
+        super().__init__(orderbook, instrument_ids, fee=fee)
+        sides = tuple(self.SIDES if sides is None else sides)
+        positions = {_id: i for i, _id in enumerate(self.instrument_ids)}
+        self.sides = sides
+        self.forward_plan = compile_legs(self.instrument_ids, sides, positions)
+        self.backward_plan = compile_legs(
+            self.instrument_ids[::-1], [1 - side for side in sides[::-1]], positions
+        )
+
+        # Per instrument, the (direction, leg) pairs it trades and the pairs
+        # whose trigger it is an input to
+        self.l1_positions = positions
+        self.plans = {FORWARD: self.forward_plan, BACKWARD: self.backward_plan}
+        self.trigger_legs = {_id: [] for _id in self.instrument_ids}
+        self.trigger_dependents = {_id: [] for _id in self.instrument_ids}
+        for direction, plan in self.plans.items():
+            for k, leg in enumerate(plan):
+                for _id in self.instrument_ids:
+                    if _id == leg.instrument_id:
+                        self.trigger_legs[_id].append((direction, k))
+                    else:
+                        self.trigger_dependents[_id].append((direction, k))
+        self._reset_triggers()
+
+    def on(self, orderbook):
+        triangle = super().on(orderbook)
+        triangle._reset_triggers()
+        return triangle
+
+    def _reset_triggers(self):
+        self._trigger_book = None
+        self._trigger_prices = {}  # L1 price index -> last price seen
+        self._triggers = {}  # (direction, leg index) -> trigger price, absent when stale
+
+    def crossed(self, changed_instruments) -> bool:
+        """crossed.
+        One comparison per leg the changed instruments trade, against a
+        trigger price refreshed only when another leg's price has moved.
+
+        :param changed_instruments: ids whose top of book moved since the last call
+        :returns: True if either direction is profitable before sizing
+        """
+        orderbook = self.orderbook
+        if self._trigger_book is not orderbook:
+            # First call on this book, every price is an input
+            self._trigger_book = orderbook
+            self._trigger_prices = {}
+            self._triggers = {}
+            changed_instruments = self.instrument_ids
+
+        prices = self._trigger_prices
+        triggers = self._triggers
+        moved = [_id for _id in self.instrument_ids if _id in changed_instruments]
+        try:
+            for _id in moved:
+                book = orderbook[_id]
+                position = 4 * self.l1_positions[_id]
+                prices[position] = book.best_ask_price()
+                prices[position + 2] = book.best_bid_price()
+                for key in self.trigger_dependents[_id]:
+                    triggers.pop(key, None)
+        except IndexError:  # Empty side, nothing to trade until it refills
+            prices.clear()
+            triggers.clear()
+            self._trigger_book = None
+            return False
+
+        plans = self.plans
+        for _id in moved:
+            for key in self.trigger_legs[_id]:
+                direction, k = key
+                trigger = triggers.get(key)
+                if trigger is None:
+                    trigger = triggers[key] = self._trigger(plans[direction], k)
+                leg = plans[direction][k]
+                # Sells cross above the trigger, buys below, e is 1 or -1
+                if prices[leg.price_index] * leg.rate_exponent > trigger * leg.rate_exponent:
+                    return True
+        return False
+
+    def _trigger(self, plan, k):
+        prices = self._trigger_prices
+        others = self.triangle_value_multiplier
+        for j, leg in enumerate(plan):
+            if j != k:
+                others *= prices[leg.price_index] ** leg.rate_exponent
+        return others ** -plan[k].rate_exponent
 
     def forward(self) -> float:
-        return (
-            1
-            / (
-                self.orderbook[self.instrument_1].get_ask_prices()[0]
-                / self.orderbook[self.instrument_2].get_bid_prices()[0]
-                / self.orderbook[self.instrument_3].get_bid_prices()[0]
-            )
-            * self.triangle_value_multiplier
-        )
+        return self._multiplier(self.forward_plan)
 
     def forward_net(self, cash_available):
-        value = self._get_forward_cash_throughput(cash_available)
-        multiplier = self.forward()
-        return (multiplier - 1) * value
+        return self._net(self.forward_plan, cash_available)
 
     def get_forward_orders(self, cash_available: float) -> Tuple[Order]:
-        # This is harder than I thought
-        #
-        # First I need to identify what the bottleneck is between the three
-        # Then I need to propagate the value of that trade back
+        return self._orders(self.forward_plan, cash_available)
 
-        # Aliases
-        fee_adjustment = self.adjusted_single_trade_value
+    def backward(self) -> float:
+        return self._multiplier(self.backward_plan)
+
+    def backward_net(self, cash_available):
+        return self._net(self.backward_plan, cash_available)
 
-        throughput = self._get_forward_cash_throughput(cash_available)
-        if throughput < 0:
+    def get_backward_orders(self, cash_available):
+        return self._orders(self.backward_plan, cash_available)
+
+    def _multiplier(self, plan):
+        l1 = self.l1()
+        multiplier = self.triangle_value_multiplier
+        for leg in plan:
+            multiplier *= l1[leg.price_index] ** leg.rate_exponent
+        return multiplier
+
+    def _net(self, plan, cash_available):
+        throughput, multiplier = self._throughput(plan, cash_available)
+        return (multiplier - 1) * throughput
+
+    def _throughput(self, plan, cash_available):
+        # Each leg can take at most its L1 quantity, in its input asset. Convert
+        # every limit back to cash at the start of the cycle.
+        l1 = self.l1()
+        fee_adjustment = self.adjusted_single_trade_value
+        current_best = cash_available
+        rate = 1.0  # Input units of the current leg per unit of cash
+        for leg in plan:
+            price = l1[leg.price_index]
+            limit = l1[leg.quantity_index] * price ** leg.input_exponent / rate
+            if limit < current_best:
+                current_best = limit
+            rate *= fee_adjustment * price ** leg.rate_exponent
+        return current_best, rate
+
+    def _orders(self, plan, cash_available):
+        amount, multiplier = self._throughput(plan, cash_available)
+        if amount < 0 or multiplier != multiplier:  # nan crosses an empty side
             return None
 
-        btc_cad_ask_price = self.orderbook[self.instrument_1].get_ask_prices()[0]
-        btc_usdt_bid_price = self.orderbook[self.instrument_2].get_bid_prices()[0]
-        usdt_cad_bid_price = self.orderbook[self.instrument_3].get_bid_prices()[0]
+        l1 = self.l1()
+        fee_adjustment = self.adjusted_single_trade_value
+        orders = []
+        for leg in plan:
+            price = l1[leg.price_index]
+            orders.append(
+                Order(
+                    instrument_id=leg.instrument_id,
+                    side=leg.side,
+                    quantity=amount / price ** leg.input_exponent,
+                    order_type=ORDER_TYPE_MARKET,
+                    expected_price=price,
+                )
+            )
+            amount *= fee_adjustment * price ** leg.rate_exponent
+        return tuple(orders)
 
-        order1_qty = throughput / btc_cad_ask_price
-        order2_qty = order1_qty * fee_adjustment
-        order3_qty = order2_qty * btc_usdt_bid_price * fee_adjustment
 
-        order1 = Order(
-            instrument_id=self.instrument_1,
-            side=0,
-            quantity=order1_qty,
-            order_type=ORDER_TYPE_MARKET,
-            expected_price=btc_cad_ask_price,
-        )
-        order2 = Order(
-            instrument_id=self.instrument_2,
-            side=1,
-            quantity=order2_qty,
-            order_type=ORDER_TYPE_MARKET,
-            expected_price=btc_usdt_bid_price,
-        )
-        order3 = Order(
-            instrument_id=self.instrument_3,
-            side=1,
-            quantity=order3_qty,
-            order_type=ORDER_TYPE_MARKET,
-            expected_price=usdt_cad_bid_price
-        )
+class TriangleBSS(TriangleEngine): # Forward requires Buy - Sell - Sell
+    SIDES = SIDES_BSS
 
-        return (order1, order2, order3)
 
-    def backward(self):
-        return (
-            1
-            / self.orderbook[self.instrument_3].get_ask_prices()[0]
-            / self.orderbook[self.instrument_2].get_ask_prices()[0]
-            * self.orderbook[self.instrument_1].get_bid_prices()[0]
-        ) * self.triangle_value_multiplier
+class TriangleBBS(TriangleEngine): # Forward Requires Buy - Buy - Sell
+    SIDES = SIDES_BBS
 
-    def backward_net(self, cash_available):
-        value = self._get_backward_cash_throughput(cash_available)
-        multiplier = self.backward()
 
-        return (multiplier - 1) * value
+# Result of a joint ladder walk: cash in, cash out, and per leg the base
+# quantity traded and its quote notional.
+LadderWalk = namedtuple("LadderWalk", ["cash_in", "cash_out", "quantities", "notionals"])
 
-    def get_backward_orders(self, cash_available):
-        fee_adjustment = self.adjusted_single_trade_value
 
-        throughput = self._get_backward_cash_throughput(cash_available)
-        if throughput < 0:
-            return None
+class TriangleBSSL2(TriangleBSS):
+    """TriangleBSS sized against the full depth of the three ladders.
 
-        usdt_cad_ask_price = self.orderbook[self.instrument_3].get_ask_prices()[0]
-        btc_usdt_ask_price = self.orderbook[self.instrument_2].get_ask_prices()[0]
-        btc_cad_bid_price = self.orderbook[self.instrument_1].get_bid_prices()[0]
+    Walks the ladders of all three legs together, one price segment at a time,
+    and keeps trading while the marginal cycle rate after fees is above 1.
+    Since every level is worse than the last, the marginal rate only falls, so
+    stopping there gives the size that maximizes net profit. Net values are 0
+    when no size is profitable. The walk follows the compiled legs, so it works
+    for subclasses with other SIDES too.
 
-        order1_qty = throughput / usdt_cad_ask_price
-        order2_qty = order1_qty / btc_usdt_ask_price * fee_adjustment
-        order3_qty = order2_qty * fee_adjustment
+    Walks are only cached on copies from on() or capture(). A live book can
+    change at any depth without moving L1, so the live instance walks every time.
+    """
 
-        order1 = Order(
-            instrument_id=self.instrument_3,
-            side=0,
-            quantity=order1_qty,
-            order_type=ORDER_TYPE_MARKET,
-            expected_price=usdt_cad_ask_price
-        )
-        order2 = Order(
-            instrument_id=self.instrument_2,
-            side=0,
-            quantity=order2_qty,
-            order_type=ORDER_TYPE_MARKET,
-            expected_price=btc_usdt_ask_price
-        )
-        order3 = Order(
-            instrument_id=self.instrument_1,
-            side=1,
-            quantity=order3_qty,
-            order_type=ORDER_TYPE_MARKET,
-            expected_price=btc_cad_bid_price
+    def __init__(self, orderbook, instrument_ids=[BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID], fee=0.002):
+        super().__init__(orderbook, instrument_ids, fee=fee)
+        self._walks = None
+
+    def on(self, orderbook):
+        triangle = super().on(orderbook)
+        triangle._walks = {}
+        return triangle
+
+    def capture(self, depth=None):
+        # Full depth by default, the ladders are the point
+        return super().capture(depth=depth)
+
+    def ladders(self, plan):
+        # Buys walk the asks, sells walk the bids
+        book = self.orderbook
+        return tuple(
+            (
+                book[leg.instrument_id].get_asks()
+                if leg.side == SIDE_BUY
+                else book[leg.instrument_id].get_bids(),
+                leg.side,
+            )
+            for leg in plan
         )
 
-        return (order1, order2, order3)
-
-    def _get_forward_cash_throughput(self, cash_available) -> float:
-        # Gets the L1 tradethrough value in cash amounts
-        # and provides the trade_ix, which can be used to efficiently
-        # get the trade orders
-        btc_cad_ask_price, btc_cad_ask_qty = self.orderbook[self.instrument_1].get_asks()[0]
-        usdt_cad_bid_price, usdt_cad_bid_qty = self.orderbook[self.instrument_3].get_bids()[0]
-        btc_usdt_bid_price, btc_usdt_bid_qty = self.orderbook[self.instrument_2].get_bids()[0]
-
-        # Trying to minimize computation
-        current_best = cash_available
-
-        t1_order = btc_cad_ask_qty * btc_cad_ask_price
+    def forward_net(self, cash_available):
+        walk = self._walk(FORWARD, cash_available)
+        return walk.cash_out - walk.cash_in
 
-        if t1_order < current_best:
-            current_best = t1_order
+    def backward_net(self, cash_available):
+        walk = self._walk(BACKWARD, cash_available)
+        return walk.cash_out - walk.cash_in
 
-        t2_order = (
-            btc_usdt_bid_qty * btc_cad_ask_price / self.adjusted_single_trade_value
+    def get_forward_orders(self, cash_available):
+        return self._walk_orders(
+            self._walk(FORWARD, cash_available), self.forward_plan
         )
-        if t2_order < current_best:
-            current_best = t2_order
 
-        t3_order = (
-            usdt_cad_bid_qty
-            * btc_cad_ask_price
-            / (btc_usdt_bid_price * self.adjusted_single_trade_value ** 2)
+    def get_backward_orders(self, cash_available):
+        return self._walk_orders(
+            self._walk(BACKWARD, cash_available), self.backward_plan
         )
-        if t3_order < current_best:
-            current_best = t3_order
-
-        return current_best
 
-    def _get_backward_cash_throughput(self, cash_available) -> float:
-        btc_cad_bid_price, btc_cad_bid_qty = self.orderbook[self.instrument_1].get_bids()[0]
-        usdt_cad_ask_price, usdt_cad_ask_qty = self.orderbook[self.instrument_3].get_asks()[0]
-        btc_usdt_ask_price, btc_usdt_ask_qty = self.orderbook[self.instrument_2].get_asks()[0]
-
-        current_best = cash_available
-
-        t1_order = usdt_cad_ask_qty * usdt_cad_ask_price
-        if t1_order < current_best:
-            current_best = t1_order
+    def _walk(self, direction, cash_available):
+        walks = self._walks
+        key = (direction, cash_available)
+        walk = walks.get(key) if walks is not None else None
+        if walk is None:
+            plan = self.forward_plan if direction == FORWARD else self.backward_plan
+            walk = self._walk_legs(self.ladders(plan), cash_available)
+            if walks is not None:
+                walks[key] = walk
+        return walk
+
+    def _walk_legs(self, legs, cash_available):
+        """_walk_legs.
+        Joint walk of the leg ladders, best level first. Each step trades
+        until the first of the current levels runs out.
+
+        :param legs: sequence of (levels, side). The output of each leg is the input of the next.
+        :param cash_available: most cash to put in the first leg
+        :returns: LadderWalk
+        """
+        fee_adjustment = self.adjusted_single_trade_value
+        n_legs = len(legs)
+        positions = [0] * n_legs
+        remaining = []  # Input units left at each leg's current level
+        for levels, side in legs:
+            if not levels:
+                return LadderWalk(0.0, 0.0, (0.0,) * n_legs, (0.0,) * n_legs)
+            price, quantity = levels[0]
+            remaining.append(quantity * price if side == SIDE_BUY else quantity)
+
+        cash_in = cash_out = 0.0
+        quantities = [0.0] * n_legs
+        notionals = [0.0] * n_legs
+        while True:
+            # Input units of each leg per unit of cash at the current levels
+            rates = []
+            rate = 1.0
+            for (levels, side), position in zip(legs, positions):
+                rates.append(rate)
+                price = levels[position][0]
+                rate *= fee_adjustment / price if side == SIDE_BUY else price * fee_adjustment
+            if rate <= 1.0:
+                break
+
+            # The step is capped by the cash left, unless a level runs out first
+            step = cash_available - cash_in
+            done = True
+            for leg_remaining, leg_rate in zip(remaining, rates):
+                if leg_remaining / leg_rate < step:
+                    step = leg_remaining / leg_rate
+                    done = False
+
+            for i, ((levels, side), leg_rate) in enumerate(zip(legs, rates)):
+                price = levels[positions[i]][0]
+                amount = step * leg_rate
+                base = amount / price if side == SIDE_BUY else amount
+                quantities[i] += base
+                notionals[i] += base * price
+                remaining[i] -= amount
+                if remaining[i] <= (remaining[i] + amount) * 1e-12:
+                    positions[i] += 1
+                    if positions[i] == len(levels):  # Ladder exhausted
+                        done = True
+                        continue
+                    price, quantity = levels[positions[i]]
+                    remaining[i] = quantity * price if side == SIDE_BUY else quantity
+
+            cash_in += step
+            cash_out += step * rate
+            if done:
+                break
+
+        return LadderWalk(cash_in, cash_out, tuple(quantities), tuple(notionals))
+
+    @staticmethod
+    def _walk_orders(walk, plan):
+        if walk.cash_in <= 0:
+            return None
 
-        t2_order = (
-            btc_usdt_ask_qty
-            * btc_usdt_ask_price
-            * usdt_cad_ask_price
-            / self.adjusted_single_trade_value
-        )
-        if t2_order < current_best:
-            current_best = t2_order
-
-        t3_order = (
-            btc_cad_bid_qty
-            * usdt_cad_ask_price
-            * btc_usdt_ask_price
-            / self.adjusted_single_trade_value ** 2
+        return tuple(
+            Order(
+                instrument_id=leg.instrument_id,
+                side=leg.side,
+                quantity=quantity,
+                order_type=ORDER_TYPE_MARKET,
+                expected_price=notional / quantity,  # VWAP over the levels crossed
+            )
+            for leg, quantity, notional in zip(plan, walk.quantities, walk.notionals)
         )
-        if t3_order < current_best:
-            current_best = t3_order
 
-        return current_best
 
 class TriangleBTCUSDTL1(TriangleBSS):
     def __init__(self, orderbook, **kwargs):
         instrument_ids = [BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID]
         super().__init__(orderbook, instrument_ids, fee=0.002)
-
-class TriangleBBS(TriangleL1): # Forward Requires Buy - Buy - Sell
-
-
-    def forward(self):
-        pass
-
-    def forward_net(self):
-        pass
-
-    def get_forward_orders(self):
-        pass
-
-    def backward(self):
-        pass
-
-    def backward_net(self, cash_available):
-        pass
-
-    def get_backward_orders(self, cash_available):
-        pass
@@ -0,0 +1,137 @@
+import logging
+from collections import deque
+from itertools import count
+
+from hermes.utils.structures import OrderRecord
+
+ORDER_PENDING = "pending"  # Planned or sent, not yet acknowledged
+ORDER_ACKED = "acked"  # Working on the exchange
+ORDER_PARTIALLY_FILLED = "partially_filled"
+ORDER_FILLED = "filled"
+ORDER_CANCELLED = "cancelled"  # Cancelled, rejected or expired
+
+TERMINAL_STATES = frozenset([ORDER_FILLED, ORDER_CANCELLED])
+
+# NDAX OrderStateEvent states
+NDAX_ORDER_STATES = {
+    "Working": ORDER_ACKED,
+    "FullyExecuted": ORDER_FILLED,
+    "Cancelled": ORDER_CANCELLED,
+    "Rejected": ORDER_CANCELLED,
+    "Expired": ORDER_CANCELLED,
+}
+
+DEFAULT_HISTORY = 1000  # Completed executions kept for late events and inspection
+
+
+class OrderStore:
+    """Lifecycle of every order sent, by client id and by execution.
+
+    Live orders are indexed by client id, and each execution keeps the set of
+    its orders still open, so state changes and completion checks are O(1).
+    Every leg of an execution is added before the first is sent, so legs that
+    are still to be sent keep it open.
+    Once every order of an execution is filled or cancelled, the execution is
+    retired into a ring buffer of the last history executions. Its records
+    stay readable until they fall out of it, which keeps memory flat however
+    long the trader runs.
+    """
+
+    def __init__(self, history=DEFAULT_HISTORY):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.execution_ids = count(1)
+        self.orders = {}  # client id -> OrderRecord, live executions only
+        self.executions = {}  # execution id -> [OrderRecord]
+        self.open_orders = {}  # execution id -> set of open client ids
+        self.history = deque(maxlen=history)  # (execution id, [OrderRecord])
+        self.retired = {}  # client id -> OrderRecord, for executions in history
+
+    def __len__(self):
+        return len(self.orders)
+
+    def new_execution(self):
+        execution_id = next(self.execution_ids)
+        self.executions[execution_id] = []
+        self.open_orders[execution_id] = set()
+        return execution_id
+
+    def add(self, client_id, execution_id, order):
+        """add.
+        Record a planned leg of an execution, as pending.
+        """
+        record = OrderRecord(client_id, execution_id, order, ORDER_PENDING)
+        self.orders[client_id] = record
+        self.executions[execution_id].append(record)
+        self.open_orders[execution_id].add(client_id)
+        return record
+
+    def get(self, client_id):
+        """get.
+
+        :returns: the OrderRecord, live or retired, or None if unknown or forgotten
+        """
+        record = self.orders.get(client_id)
+        if record is None:
+            record = self.retired.get(client_id)
+        return record
+
+    def fill(self, client_id, quantity):
+        """fill.
+        Add an execution report. The order stays partially filled until its
+        state event says otherwise.
+
+        :returns: the OrderRecord, or None if unknown
+        """
+        record = self.get(client_id)
+        if record is None:
+            return None
+        record.filled_quantity += quantity
+        if record.state not in TERMINAL_STATES:
+            record.state = ORDER_PARTIALLY_FILLED
+        return record
+
+    def set_state(self, client_id, state):
+        """set_state.
+        Move a live order to state. An execution whose last open order becomes
+        filled or cancelled is retired.
+
+        :returns: the OrderRecord, or None if the order is not live
+        """
+        record = self.orders.get(client_id)
+        if record is None:
+            return None
+        record.state = state
+        if state in TERMINAL_STATES:
+            open_orders = self.open_orders[record.execution_id]
+            open_orders.discard(client_id)
+            if not open_orders:
+                self.retire(record.execution_id)
+        return record
+
+    def is_complete(self, execution_id):
+        return execution_id not in self.open_orders
+
+    def retire(self, execution_id):
+        records = self.executions.pop(execution_id)
+        del self.open_orders[execution_id]
+
+        history = self.history
+        if len(history) == history.maxlen:
+            _, evicted = history[0]
+            for record in evicted:
+                self.retired.pop(record.client_id, None)
+        history.append((execution_id, records))
+
+        for record in records:
+            del self.orders[record.client_id]
+            self.retired[record.client_id] = record
+
+    def clear(self):
+        """clear.
+        Forget every live order, such as after a reset. History is kept.
+        """
+        if self.orders:
+            self.logger.info(f"Dropping {len(self.orders)} live orders")
+        self.orders = {}
+        self.executions = {}
+        self.open_orders = {}
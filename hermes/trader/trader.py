@@ -1,17 +1,34 @@
 import asyncio
 import logging
-from hermes.exchanges.ndax import create_request, BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID
+from hermes.exchanges.ndax import (
+    NDAXOrderEncoder,
+    BTCCAD_ID,
+    BTCUSDT_ID,
+    USDTCAD_ID,
+)
+from hermes.trader.orders import (
+    OrderStore,
+    ORDER_FILLED,
+    ORDER_CANCELLED,
+    NDAX_ORDER_STATES,
+)
 from hermes.utils.structures import Order
+from hermes.utils.latency import (
+    LatencyTracer,
+    STAGE_STRATEGY,
+    STAGE_ENCODE,
+    STAGE_SEND,
+)
+from hermes.utils.ratelimit import PRIORITY_ORDER
 from hermes.utils.synchronization import SingletonTradeLock, SingletonResetEvent
 from uuid import uuid1
 from typing import List
 from math import floor
+from time import perf_counter_ns
 
 FORWARD = 0
 BACKWARD = 1
 
-QTY_DECIMAL_PLACES = {BTCCAD_ID: 6, BTCUSDT_ID: 6, USDTCAD_ID: 2}
-
 
 class NDAXTrader:
     def __init__(self, session, orderbook, account_id):
@@ -19,34 +36,25 @@ class NDAXTrader:
         self.session = session
         self.orderbook = orderbook
         self.account_id = account_id
-        self.order_records = {}
+        self.orders = OrderStore()
         self.pending_orders = []
         self.current_trade_id = 1
+        self.order_encoder = NDAXOrderEncoder(account_id)
 
         # Singleton trade lock, so it can be shared with other components easily
         self.trade_lock = SingletonTradeLock.instance()
         self.reset_trigger = SingletonResetEvent.instance()
+        self.tracer = LatencyTracer.instance()
 
     async def run(self):
         pass
 
+    def register_handlers(self, router):
+        router.register("OrderTradeEvent", self.handle_trade_event)
+        router.register("OrderStateEvent", self.handle_state_change_event)
+
     def format_request(self, client_id: int, order: Order):
-        payload = {
-            "InstrumentId": order.instrument_id,
-            "OMSId": 1,
-            "AccountId": self.account_id,
-            "TimeInForce": order.time_in_force,
-            "ClientOrderId": client_id,
-            "OrderIdOCO": 0,
-            "UseDisplayQuantity": False,
-            "Side": order.side,
-            "Quantity": round(order.quantity, QTY_DECIMAL_PLACES[order.instrument_id]),
-            "OrderType": order.order_type,
-            "PegPriceType": 1,
-        }
-
-        request = create_request(0, "SendOrder", payload)
-        return request
+        return self.order_encoder.encode(client_id, order)
 
     def create_trade_id(self):
         self.current_trade_id += 1
@@ -55,9 +63,12 @@ class NDAXTrader:
     async def handle_trade_event(self, response):
         pass
 
+    async def handle_state_change_event(self, response):
+        pass
+
     async def send_requests(self, requests):
         for req in requests:
-            self.session.send(req)
+            await self.session.send(req, priority=PRIORITY_ORDER)
 
 
 class NDAXMarketTriangleLogger(NDAXTrader):
@@ -119,7 +130,7 @@ class NDAXMarketTriangleTrader(NDAXTrader):
         self.cash_available = cash_available
         self.debug_mode = debug_mode
         self.VALUE_DIFF_THRESH = 0.001
-        self.outstanding_orders = []
+        self.last_sent_id = None
         self.pending_orders = []
         self.sequential = sequential
 
@@ -128,27 +139,56 @@ class NDAXMarketTriangleTrader(NDAXTrader):
         )
 
     def reset(self):
-        self.outstanding_orders = []
+        self.orders.clear()
+        self.last_sent_id = None
         self.pending_orders = []
         self.permanent_trade_lock = False
 
+    def register_handlers(self, router):
+        super().register_handlers(router)
+        # Deferred: evaluate once per batch of book updates, against the newest book
+        router.register("Level2UpdateEvent", self.handle_level2_update, deferred=True)
+
+    async def handle_level2_update(self, payload):
+        changed = self.orderbook.pop_updated_instruments()
+        if changed:  # Only re-evaluate when some L1 actually moved
+            await self.recheck_orderbook_and_trade(changed)
+
+    async def recheck_orderbook_and_trade(self, changed_instruments=None):
+        if changed_instruments is not None:
+            # Skip evaluation if none of the triangle's L1 quotes moved
+            if changed_instruments.isdisjoint(self.triangle.instrument_ids):
+                return
+
+            # No leg crossed its trigger price, neither direction can pay.
+            # Checked even while locked so the triggers see every update.
+            if not self.triangle.crossed(changed_instruments):
+                return
 
-    async def recheck_orderbook_and_trade(self):
         if self.permanent_trade_lock or self.trade_lock.locked():
             return
 
+        # Books waiting on a resync snapshot can't be traded against
+        if not self.orderbook.is_valid(self.triangle.instrument_ids):
+            return
+
+        start = perf_counter_ns() if self.tracer.enabled else 0
         orders = None
         try:
-            forward_val = self.triangle.forward_net(self.cash_available)
+            # Value and size the trade from one capture of the books
+            triangle = self.triangle.capture()
+            forward_val = triangle.forward_net(self.cash_available)
             if forward_val > self.min_trade_value:
-                orders = self.triangle.get_forward_orders(self.cash_available)
+                orders = triangle.get_forward_orders(self.cash_available)
 
             else:
-                backward_val = self.triangle.backward_net(self.cash_available)
+                backward_val = triangle.backward_net(self.cash_available)
                 if backward_val > self.min_trade_value:
-                    orders = self.triangle.get_backward_orders(self.cash_available)
+                    orders = triangle.get_backward_orders(self.cash_available)
         except IndexError as e:
             self.logger.warning(f"Index Error: {e}")
+        if start:
+            self.tracer.record(STAGE_STRATEGY, start)
 
         if not orders:
             return
@@ -159,30 +199,46 @@ class NDAXMarketTriangleTrader(NDAXTrader):
         # For the market triangle, we just send all of them immediately
         await self.trade_lock.acquire()
 
+        # Every leg is recorded up front, so the execution can't complete
+        # while sequential legs are still waiting to be sent
+        execution_id = self.orders.new_execution()
+        records = [
+            self.orders.add(self.create_trade_id(), execution_id, order)
+            for order in orders
+        ]
         if self.sequential:
-            self.pending_orders = orders[1:]
-            await self.send_order(orders[0])
+            self.pending_orders = records[1:]
+            await self.send_order(records[0])
         else:
-            for order in orders:
-                await self.send_order(order)
+            for record in records:
+                await self.send_order(record)
 
     async def handle_trade_event(self, event_payload):
         self.logger.info("Handling Trade Event")
         self.match_order(event_payload)
 
-        if self.sequential and len(self.pending_orders) != 0:
-            next_order = self.pending_orders.pop()
+        # The first fill of the last leg sent releases the next one
+        if (
+            self.sequential
+            and len(self.pending_orders) != 0
+            and event_payload["ClientOrderId"] == self.last_sent_id
+        ):
+            next_order = self.pending_orders.pop(0)
             await self.send_order(next_order)
 
-    async def send_order(self, order):
+    async def send_order(self, record):
+        order = record.order
         self.logger.info(f"Sending Order: {order}")
+        self.last_sent_id = record.client_id
 
-        trade_id = self.create_trade_id()
-        self.order_records[trade_id] = order
-        self.outstanding_orders.append(trade_id)
-
-        request = self.format_request(trade_id, order)
-        await self.session.send(request)
+        tracer = self.tracer
+        start = perf_counter_ns() if tracer.enabled else 0
+        request = self.format_request(record.client_id, order)
+        if start:
+            tracer.record(STAGE_ENCODE, start)
+        await self.session.send(request, priority=PRIORITY_ORDER)
+        if start:
+            tracer.mark(STAGE_SEND)
 
     def match_order(self, event_payload):
         client_id = event_payload["ClientOrderId"]
@@ -192,7 +248,12 @@ class NDAXMarketTriangleTrader(NDAXTrader):
         instrument_id = event_payload["InstrumentId"]
         value = event_payload["Value"]
 
-        expected_order = self.order_records[client_id]
+        record = self.orders.fill(client_id, quantity)
+        if record is None:
+            self.logger.warning(f"Trade for unknown order {client_id}: {event_payload}")
+            return
+
+        expected_order = record.order
         expected_price = expected_order.expected_price
         expected_quantity = expected_order.quantity
 
@@ -231,21 +292,24 @@ class NDAXMarketTriangleTrader(NDAXTrader):
 
     async def handle_state_change_event(self, event_payload):
         client_id = event_payload["ClientOrderId"]
-        status = event_payload["OrderState"]
-        if status == "FullyExecuted":
-            self.outstanding_orders.remove(client_id)
-            # Release trade lock if everything came back
-            if len(self.outstanding_orders) == 0:
-                self.logger.info('Releasing Trade Lock')
-                self.trade_lock.release()
-        elif status == 'Cancelled':
+        state = NDAX_ORDER_STATES.get(event_payload["OrderState"])
+        if state is None:
+            return
+
+        record = self.orders.set_state(client_id, state)
+        if state == ORDER_CANCELLED:
+            # Known or not, a cancel means the books or session are off
             self.logger.error(f'Cancelled: {event_payload}')
             await asyncio.sleep(0.5) # wait half a second
-            self.trade_lock.release()
+            if self.trade_lock.locked():
+                self.trade_lock.release()
             self.reset_trigger.set()
-
-    def reset(self):
-        self.order_records = {}
+        elif record is None:
+            self.logger.warning(f"State change for unknown order {client_id}: {event_payload}")
+        elif state == ORDER_FILLED and self.orders.is_complete(record.execution_id):
+            # Release trade lock if everything came back
+            self.logger.info('Releasing Trade Lock')
+            self.trade_lock.release()
 
 
 class NDAXDummyTriangleTrader(NDAXMarketTriangleTrader):
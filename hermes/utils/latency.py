@@ -0,0 +1,156 @@
+import logging
+from time import perf_counter_ns
+
+# Pipeline stages, in the order a frame passes through them
+STAGE_RECEIVE = "receive"  # Frame receipt to the start of processing (queue wait)
+STAGE_PARSE = "parse"
+STAGE_BOOK = "book_apply"
+STAGE_STRATEGY = "strategy"
+STAGE_ENCODE = "encode"
+STAGE_SEND = "send"  # Frame receipt to the order leaving, end to end
+
+STAGES = (
+    STAGE_RECEIVE,
+    STAGE_PARSE,
+    STAGE_BOOK,
+    STAGE_STRATEGY,
+    STAGE_ENCODE,
+    STAGE_SEND,
+)
+
+REPORT_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+# Log-linear buckets: exact below 2 ** SUB_BUCKET_BITS, then 2 ** (SUB_BUCKET_BITS - 1)
+# buckets per power of two, which keeps every value within ~3% of its bucket.
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+MAX_VALUE_BITS = 40  # ~18 minutes in ns, larger values are clamped
+
+
+class LatencyHistogram:
+    """HDR-style histogram of nanosecond values.
+
+    Recording is a bit_length, a shift and a list increment, with no
+    allocation, so it can sit on the hot path.
+    """
+
+    def __init__(self):
+        self.counts = [0] * self.bucket_index((1 << MAX_VALUE_BITS) - 1) + [0]
+        self.max_index = len(self.counts) - 1
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    @staticmethod
+    def bucket_index(value):
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        if shift <= 0:
+            return value
+        return shift * HALF_SUB_BUCKETS + (value >> shift)
+
+    @staticmethod
+    def bucket_upper_bound(index):
+        if index < SUB_BUCKETS:
+            return index
+        shift = index // HALF_SUB_BUCKETS - 1
+        sub_bucket = index - shift * HALF_SUB_BUCKETS
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        index = self.bucket_index(value)
+        self.counts[min(index, self.max_index)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percentile):
+        """percentile.
+
+        :param percentile: in [0, 100]
+        :returns: the highest value equivalent to the percentile's bucket, capped at max
+        """
+        if not self.count:
+            return 0
+        target = max(1, round(self.count * percentile / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.bucket_upper_bound(index), self.max)
+        return self.max
+
+
+class LatencyTracer:
+    """Per-stage latency histograms for the frame to order pipeline.
+
+    Disabled by default. Call sites check enabled before taking any stamp,
+    so a disabled tracer costs an attribute read per stage. Processing is
+    sequential, so the receive stamp of the batch being processed is held
+    in origin_ns for the end to end stages.
+    """
+
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+
+        return cls._instance
+
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.enabled = False
+        self.origin_ns = 0
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+
+    def begin(self, received_ns):
+        """begin.
+        Start tracing a batch of frames received at received_ns.
+        """
+        self.origin_ns = received_ns
+        self.histograms[STAGE_RECEIVE].record(perf_counter_ns() - received_ns)
+
+    def record(self, stage, start_ns):
+        """record.
+        Record the time a stage took since start_ns.
+        """
+        self.histograms[stage].record(perf_counter_ns() - start_ns)
+
+    def mark(self, stage):
+        """mark.
+        Record the time since the current batch was received.
+        """
+        self.histograms[stage].record(perf_counter_ns() - self.origin_ns)
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    def log_report(self):
+        for stage, histogram in self.histograms.items():
+            if not histogram.count:
+                continue
+            percentiles = ", ".join(
+                f"p{p:g} {histogram.percentile(p) / 1000:.1f}us"
+                for p in REPORT_PERCENTILES
+            )
+            self.logger.info(
+                f"{stage}: {histogram.count} samples, {percentiles}, max {histogram.max / 1000:.1f}us"
+            )
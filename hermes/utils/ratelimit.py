@@ -0,0 +1,100 @@
+import asyncio
+import heapq
+from collections import deque
+from itertools import count
+from time import monotonic
+
+# Lower values are served first
+PRIORITY_ORDER = 0
+PRIORITY_SUBSCRIPTION = 1
+PRIORITY_ACCOUNT = 2
+
+
+class SlidingWindowRateLimiter:
+    """Sliding-window rate limiter over a deque of monotonic send timestamps.
+
+    Allows at most limit sends in any window seconds. The last reserved slots
+    of the window can only be used by PRIORITY_ORDER, so subscriptions and
+    account polls never use up the budget order entry needs. Callers that
+    can wait use acquire(). It queues them by priority, and one timer wakes
+    them when the oldest send leaves the window, so no task is spawned per send.
+    """
+
+    def __init__(self, limit, window=60.0, reserved=0):
+        if not 0 <= reserved < limit:
+            raise ValueError(f"reserved must be in [0, {limit}), got {reserved}")
+        self.limit = limit
+        self.window = window
+        self.reserved = reserved
+        self.sent = deque()
+        self.waiters = []  # heap of (priority, arrival, future)
+        self.arrivals = count()
+        self.timer = None
+
+    def budget(self, priority):
+        return self.limit if priority == PRIORITY_ORDER else self.limit - self.reserved
+
+    def expire(self, now):
+        cutoff = now - self.window
+        sent = self.sent
+        while sent and sent[0] <= cutoff:
+            sent.popleft()
+
+    def available(self, priority=PRIORITY_ORDER):
+        self.expire(monotonic())
+        return max(0, self.budget(priority) - len(self.sent))
+
+    def try_acquire(self, priority=PRIORITY_ORDER):
+        """try_acquire.
+        Take a slot if one is free and nobody of equal or higher priority is
+        already waiting.
+
+        :returns: True if the slot was taken
+        """
+        now = monotonic()
+        self.expire(now)
+        if self.waiters and self.waiters[0][0] <= priority:
+            return False
+        if len(self.sent) >= self.budget(priority):
+            return False
+
+        self.sent.append(now)
+        return True
+
+    async def acquire(self, priority=PRIORITY_ORDER):
+        """acquire.
+        Wait until a slot is free for this priority, then take it.
+        """
+        if self.try_acquire(priority):
+            return
+
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.arrivals), future))
+        self.schedule_wake()
+        await future
+
+    def schedule_wake(self):
+        if self.timer is not None or not self.waiters:
+            return
+
+        delay = self.sent[0] + self.window - monotonic() if self.sent else 0
+        self.timer = asyncio.get_event_loop().call_later(max(delay, 0), self.wake)
+
+    def wake(self):
+        self.timer = None
+        now = monotonic()
+        self.expire(now)
+
+        waiters = self.waiters
+        while waiters:
+            priority, _, future = waiters[0]
+            if future.done():  # Cancelled while waiting
+                heapq.heappop(waiters)
+                continue
+            if len(self.sent) >= self.budget(priority):
+                break
+            heapq.heappop(waiters)
+            self.sent.append(now)
+            future.set_result(None)
+
+        self.schedule_wake()
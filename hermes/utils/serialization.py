@@ -0,0 +1,33 @@
+"""JSON backend selection.
+
+Uses orjson or ujson when installed and falls back to the standard library.
+Every backend raises a ValueError subclass on malformed input.
+"""
+
+try:
+    import orjson
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    JSON_BACKEND = "orjson"
+
+except ImportError:
+    try:
+        import ujson
+
+        def loads(data):
+            return ujson.loads(data)
+
+        def dumps(obj):
+            return ujson.dumps(obj)
+
+        JSON_BACKEND = "ujson"
+
+    except ImportError:
+        from json import loads, dumps
+
+        JSON_BACKEND = "json"
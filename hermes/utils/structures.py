@@ -10,9 +10,28 @@ class Order:
     limit_price: float = 999999  # Just in case
     time_in_force: int = 1
     expected_price: Optional[float] = None
+    venue: Optional[str] = None  # Exchange to route to, for multi-venue strategies
+
+@dataclass(frozen=True)
+class InstrumentSpec:
+    price_decimals: int  # Tick size is 10 ** -price_decimals
+    quantity_decimals: int  # Lot size is 10 ** -quantity_decimals
+    # Precision of book quantities. The feed quotes levels finer than the
+    # order lot, so books keep their own precision rather than rounding to lots.
+    book_quantity_decimals: int = 8
 
 @dataclass
 class NDAXMessage:
     message: str
     message_fn: str
     payload: dict
+    message_type: Optional[int] = None
+    sequence: Optional[int] = None
+
+@dataclass
+class OrderRecord:
+    client_id: int
+    execution_id: int  # Triangle (or other multi-leg) execution the order belongs to
+    order: Order
+    state: str
+    filled_quantity: float = 0.0
@@ -0,0 +1,127 @@
+import asyncio
+import json
+
+import pytest
+import websockets
+
+from hermes.exchanges.ndax import (
+    NDAXOrderEncoder,
+    NDAXSession,
+    RequestError,
+    create_request,
+)
+from hermes.router.decoder import NDAXDecoder
+from hermes.utils.structures import Order
+
+
+class LoopbackSocket:
+    """Answers every request with a reply carrying the same sequence number."""
+
+    def __init__(self, session, message_type=1):
+        self.decoder = NDAXDecoder(frozenset(), session.pending_requests)
+        self.session = session
+        self.message_type = message_type
+
+    async def send(self, raw):
+        request = json.loads(raw)
+        reply = dict(request, m=self.message_type)
+        message = self.decoder.decode(json.dumps(reply))
+        asyncio.get_event_loop().call_soon(self.session.resolve_request, message)
+
+
+def test_request_ids_are_unique_and_increasing():
+    ids = [json.loads(create_request(0, "Ping", {}))["i"] for _ in range(3)]
+    assert ids == sorted(set(ids))
+
+
+def test_request_resolves_with_matching_reply():
+    async def scenario():
+        session = NDAXSession(1, "key", "secret")
+        session.session = LoopbackSocket(session)
+        replies = await asyncio.gather(
+            session.request("GetAccountPositions", {"AccountId": 1}),
+            session.request("GetAccountPositions", {"AccountId": 2}),
+        )
+        return replies, session.pending_requests
+
+    replies, pending = asyncio.run(scenario())
+    assert replies == [{"AccountId": 1}, {"AccountId": 2}]
+    assert pending == {}
+
+
+def test_error_reply_raises():
+    async def scenario():
+        session = NDAXSession(1, "key", "secret")
+        session.session = LoopbackSocket(session, message_type=5)
+        await session.request("SendOrder", {})
+
+    with pytest.raises(RequestError):
+        asyncio.run(scenario())
+
+
+def test_order_encoder_matches_create_request():
+    encoder = NDAXOrderEncoder(account_id=7)
+    order = Order(instrument_id=80, side=1, quantity=12.3456, order_type=1)
+
+    expected = create_request(
+        0,
+        "SendOrder",
+        {
+            "InstrumentId": 80,
+            "OMSId": 1,
+            "AccountId": 7,
+            "TimeInForce": 1,
+            "ClientOrderId": 42,
+            "OrderIdOCO": 0,
+            "UseDisplayQuantity": False,
+            "Side": 1,
+            "Quantity": 12.35,
+            "OrderType": 1,
+            "PegPriceType": 1,
+        },
+        sequence=10,
+    )
+    assert encoder.encode(42, order, sequence=10) == expected
+
+
+def test_adopt_takes_over_standby_connections():
+    async def scenario():
+        session = NDAXSession(1, "key", "secret")
+        standby = session.create_standby()
+        standby.session, standby.market_data = LoopbackSocket(standby), object()
+        standby.session_token = "token"
+
+        waiting = asyncio.get_event_loop().create_future()
+        session.pending_requests[2] = waiting
+        session.adopt(standby)
+        return session, standby, waiting
+
+    session, standby, waiting = asyncio.run(scenario())
+    assert isinstance(session.session, LoopbackSocket)
+    assert session.session_token == "token"
+    assert session.rate_limiter is standby.rate_limiter
+    assert standby.session is None and standby.market_data is None
+    assert isinstance(waiting.exception(), RequestError)
+
+
+def test_connected_follows_websocket_state():
+    async def echo(connection):
+        async for message in connection:
+            pass
+
+    async def scenario():
+        session = NDAXSession(1, "key", "secret")
+        states = [session.connected]
+        async with websockets.serve(echo, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            session.session, session.market_data = await asyncio.gather(
+                websockets.connect(f"ws://127.0.0.1:{port}"),
+                websockets.connect(f"ws://127.0.0.1:{port}"),
+            )
+            states.append(session.connected)
+            await session.market_data.close()
+            states.append(session.connected)
+            await session.close()
+        return states
+
+    assert asyncio.run(scenario()) == [False, True, False]
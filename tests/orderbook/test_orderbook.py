@@ -0,0 +1,263 @@
+import asyncio
+import random
+
+import pytest
+
+from hermes.orderbook.orderbook import (
+    ASK,
+    BID,
+    ArrayOrderBook,
+    MultiOrderBook,
+    NDAXOrderbook,
+    OrderBook,
+    scale_decimal_string,
+)
+from hermes.exchanges.ndax import INSTRUMENT_SPECS, USDTCAD_ID
+from hermes.utils.structures import InstrumentSpec
+
+
+def l2_row(instrument, side, price, quantity, action=0, update_id=1):
+    return [update_id, 0, 0, action, 0.0, 0, price, instrument, quantity, side]
+
+
+@pytest.fixture(params=[OrderBook, ArrayOrderBook])
+def book(request):
+    return request.param(depth=3)
+
+
+class Test_OrderBookBackends:
+    def test_keeps_best_levels_within_depth(self, book):
+        for price in (10.0, 12.0, 11.0, 13.0, 9.0):
+            book.ask[price] = 1.0
+            book.bid[price] = 1.0
+
+        assert book.get_ask_prices() == [9.0, 10.0, 11.0]
+        assert book.get_bid_prices() == [13.0, 12.0, 11.0]
+
+    def test_update_and_delete(self, book):
+        book.ask[10.0] = 1.0
+        book.ask[11.0] = 2.0
+        book.ask[10.0] = 5.0
+        book.ask.pop(10.0)
+
+        assert book.get_asks() == [(11.0, 2.0)]
+
+        with pytest.raises(KeyError):
+            book.ask.pop(10.0)
+
+    def test_best_level_reads(self, book):
+        book.ask[10.5] = 0.25
+        book.bid[10.0] = 0.75
+
+        assert book.best_ask_price() == 10.5
+        assert book.best_ask_quantity() == 0.25
+        assert book.best_bid_price() == 10.0
+        assert book.best_bid_quantity() == 0.75
+
+        book.bid.clear()
+        with pytest.raises(IndexError):
+            book.best_bid_price()
+
+    def test_apply_levels_deletes_before_inserting(self, book):
+        for price in (10.0, 11.0, 12.0):
+            book.ask[price] = 1.0
+
+        book.apply_levels(ASK, {9.0: 2.0, 10.0: 0, 12.0: 3.0})
+        book.apply_levels(BID, {8.0: 1.0, 7.0: 0})
+
+        assert book.get_asks() == [(9.0, 2.0), (11.0, 1.0), (12.0, 3.0)]
+        assert book.get_bids() == [(8.0, 1.0)]
+
+    def test_array_backend_matches_sorted_backend(self):
+        rng = random.Random(7)
+        sorted_book = OrderBook(depth=5)
+        array_book = ArrayOrderBook(depth=5)
+
+        for _ in range(2000):
+            price = float(rng.randint(90, 110))
+            quantity = float(rng.randint(0, 4))
+            for book in (sorted_book, array_book):
+                side = book.bid if price < 100 else book.ask
+                if quantity:
+                    side[price] = quantity
+                else:
+                    try:
+                        side.pop(price)
+                    except KeyError:
+                        pass
+
+        assert array_book.get_asks() == sorted_book.get_asks()
+        assert array_book.get_bids() == sorted_book.get_bids()
+
+
+def test_multi_orderbook_backend_selection():
+    orderbook = MultiOrderBook(instrument_keys=(1, 2), depth=2, backend="array")
+
+    assert isinstance(orderbook[1], ArrayOrderBook)
+    assert isinstance(MultiOrderBook(depth=2)[1], OrderBook)
+
+
+def test_top_of_book_changes_reported():
+    orderbook = NDAXOrderbook(instrument_keys=(1, 2), depth=3, backend="array")
+
+    changed = asyncio.run(
+        orderbook.update([l2_row(1, 1, 10.0, 1.0), l2_row(2, 0, 5.0, 1.0)])
+    )
+    assert changed == {1, 2}
+
+    # A level behind the best ask does not move L1
+    changed = asyncio.run(orderbook.update([l2_row(1, 1, 11.0, 1.0)]))
+    assert changed == set()
+
+    changed = asyncio.run(orderbook.update([l2_row(1, 1, 10.0, 2.0, action=1)]))
+    assert changed == {1}
+    assert orderbook.pop_updated_instruments() == {1, 2}
+    assert orderbook.pop_updated_instruments() == set()
+
+
+def test_batched_update_collapses_repeated_levels():
+    orderbook = NDAXOrderbook(instrument_keys=(1,), depth=3, backend="array")
+    payload = [
+        l2_row(1, 1, 10.0, 1.0),
+        l2_row(1, 1, 10.0, 3.0, action=1),
+        l2_row(1, 1, 11.0, 1.0),
+        l2_row(1, 1, 11.0, 0.0, action=2),
+        l2_row(1, 0, 9.0, 4.0),
+    ]
+
+    asyncio.run(orderbook.update(payload))
+
+    assert orderbook[1].get_asks() == [(10.0, 3.0)]
+    assert orderbook[1].get_bids() == [(9.0, 4.0)]
+
+
+def test_sequence_gap_resyncs_only_affected_instrument():
+    orderbook = NDAXOrderbook(instrument_keys=(1, 2), depth=3, backend="array")
+    asyncio.run(
+        orderbook.snapshot(
+            [l2_row(1, 1, 10.0, 1.0, update_id=5), l2_row(2, 1, 20.0, 1.0, update_id=8)]
+        )
+    )
+
+    asyncio.run(
+        orderbook.update(
+            [
+                l2_row(1, 1, 10.0, 2.0, action=1, update_id=6),
+                l2_row(2, 1, 20.0, 2.0, action=1, update_id=10),  # skipped 9
+            ]
+        )
+    )
+
+    assert orderbook[1].get_asks() == [(10.0, 2.0)]
+    assert orderbook[2].get_asks() == []
+    assert not orderbook.is_valid((1, 2))
+    assert orderbook.is_valid((1,))
+    assert orderbook.pop_resync_requests() == {2}
+
+    # Updates for the invalid book are dropped until the snapshot arrives
+    asyncio.run(orderbook.update([l2_row(2, 1, 21.0, 1.0, update_id=11)]))
+    assert orderbook[2].get_asks() == []
+
+    asyncio.run(orderbook.snapshot([l2_row(2, 1, 22.0, 1.0, update_id=12)]))
+    assert orderbook.is_valid((1, 2))
+    assert orderbook[2].get_asks() == [(22.0, 1.0)]
+
+
+def test_stale_updates_are_dropped_without_resync():
+    orderbook = NDAXOrderbook(instrument_keys=(1,), depth=3, backend="array")
+    asyncio.run(orderbook.snapshot([l2_row(1, 1, 10.0, 1.0, update_id=5)]))
+
+    # Already covered by the snapshot
+    asyncio.run(orderbook.update([l2_row(1, 1, 9.0, 1.0, update_id=4)]))
+    asyncio.run(orderbook.update([l2_row(1, 1, 10.0, 2.0, action=1, update_id=6)]))
+
+    assert orderbook.is_valid((1,))
+    assert orderbook.pop_resync_requests() == set()
+    assert orderbook[1].get_asks() == [(10.0, 2.0)]
+
+
+@pytest.mark.parametrize("backend", ["sorted", "array"])
+def test_scaled_books_store_ticks_and_read_floats(backend):
+    spec = InstrumentSpec(price_decimals=2, quantity_decimals=6)
+    orderbook = NDAXOrderbook(
+        instrument_keys=(1,), depth=3, backend=backend, instrument_specs={1: spec}
+    )
+
+    asyncio.run(
+        orderbook.update(
+            [
+                l2_row(1, 1, 68971.67, 0.044),
+                l2_row(1, 1, 68971.67000000001, 0.045, action=1),
+                l2_row(1, 0, 68910.0, 0.15759),
+            ]
+        )
+    )
+
+    assert orderbook[1].top_of_book() == (6891000, 15759000, 6897167, 4500000)
+    assert orderbook[1].get_asks() == [(68971.67, 0.045)]
+    assert orderbook[1].best_bid_price() == 68910.0
+
+
+@pytest.mark.parametrize("backend", ["sorted", "array"])
+def test_levels_below_the_order_lot_are_kept(backend):
+    # USDTCAD orders go in lots of 0.01, the feed quotes finer levels
+    orderbook = NDAXOrderbook(
+        instrument_keys=(USDTCAD_ID,),
+        depth=3,
+        backend=backend,
+        instrument_specs=INSTRUMENT_SPECS,
+    )
+    orderbook.apply_batch(
+        {(USDTCAD_ID, ASK): {1.2301: 0.004, 1.2303: 0.006, 1.2305: 10.0}}
+    )
+
+    assert orderbook[USDTCAD_ID].get_asks() == [
+        (1.2301, 0.004),
+        (1.2303, 0.006),
+        (1.2305, 10.0),
+    ]
+
+    orderbook.apply_batch({(USDTCAD_ID, ASK): {1.2301: 1e-9, 1.2303: 0.0}})
+    assert orderbook[USDTCAD_ID].get_asks() == [(1.2301, 1e-8), (1.2305, 10.0)]
+
+
+def test_scale_decimal_string():
+    assert scale_decimal_string("68971.60000", 1) == 689716
+    assert scale_decimal_string("0.12", 8) == 12000000
+    assert scale_decimal_string("5", 2) == 500
+
+
+@pytest.mark.parametrize("backend", ["sorted", "array"])
+@pytest.mark.parametrize(
+    "spec", [None, InstrumentSpec(price_decimals=2, quantity_decimals=4)]
+)
+def test_depth_queries(backend, spec):
+    orderbook = NDAXOrderbook(
+        instrument_keys=(1,), depth=5, backend=backend, instrument_specs={1: spec}
+    )
+    asyncio.run(
+        orderbook.update(
+            [
+                l2_row(1, 1, 100.0, 1.0),
+                l2_row(1, 1, 101.0, 2.0),
+                l2_row(1, 1, 102.0, 3.0),
+                l2_row(1, 0, 99.0, 1.5),
+                l2_row(1, 0, 98.0, 0.5),
+            ]
+        )
+    )
+    # Incremental change in the middle of the ladder
+    asyncio.run(orderbook.update([l2_row(1, 1, 101.0, 1.0, action=1)]))
+    book = orderbook[1]
+
+    assert book.vwap(ASK, 2.0) == pytest.approx((100.0 + 101.0) / 2)
+    assert book.vwap(ASK, 3.0) == pytest.approx((100.0 + 101.0 + 102.0) / 3)
+    assert book.vwap(ASK, 10.0) is None
+    assert book.vwap(BID, 1.75) == pytest.approx((1.5 * 99.0 + 0.25 * 98.0) / 1.75)
+
+    assert book.quantity_within_price(ASK, 101.0) == pytest.approx(2.0)
+    assert book.quantity_within_price(ASK, 99.0) == 0.0
+    assert book.quantity_within_price(BID, 98.5) == pytest.approx(1.5)
+    assert book.notional_within_price(ASK, 101.5) == pytest.approx(201.0)
+    assert book.notional_within_bps(ASK, 150) == pytest.approx(201.0)
+    assert book.notional_within_bps(BID, 0) == pytest.approx(148.5)
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from hermes.orderbook.shared import (
+    SeqlockTimeout,
+    SharedNDAXOrderbook,
+    SharedOrderBookReader,
+)
+from hermes.strategies.arbitrage.triangle import TriangleBTCUSDTL1
+from hermes.exchanges.ndax import BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID
+
+
+def l2_row(instrument, side, price, quantity, update_id=1):
+    return [update_id, 0, 0, 0, 0.0, 0, price, instrument, quantity, side]
+
+
+@pytest.fixture
+def shared_orderbook():
+    orderbook = SharedNDAXOrderbook(
+        instrument_keys=(BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID), depth=2, backend="array"
+    )
+    yield orderbook
+    orderbook.close()
+    orderbook.unlink()
+
+
+def test_reader_sees_published_levels(shared_orderbook):
+    reader = SharedOrderBookReader(
+        shared_orderbook.name, (BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID)
+    )
+    asyncio.run(
+        shared_orderbook.update(
+            [
+                l2_row(BTCCAD_ID, 1, 68971.67, 0.044),
+                l2_row(BTCCAD_ID, 1, 68980.0, 1.0),
+                l2_row(BTCCAD_ID, 1, 68990.0, 1.0),  # beyond depth
+                l2_row(BTCCAD_ID, 0, 68910.0, 0.15759),
+                l2_row(BTCUSDT_ID, 1, 57049.62, 0.053027),
+                l2_row(BTCUSDT_ID, 0, 56538.5, 0.15759),
+                l2_row(USDTCAD_ID, 1, 1.4, 1234.16),
+                l2_row(USDTCAD_ID, 0, 1.3, 34.96),
+            ]
+        )
+    )
+
+    assert reader[BTCCAD_ID].get_asks() == ((68971.67, 0.044), (68980.0, 1.0))
+    assert reader[BTCCAD_ID].get_bids() == ((68910.0, 0.15759),)
+    assert reader.is_valid((BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID))
+
+    shared_triangle = TriangleBTCUSDTL1(reader)
+    local_triangle = TriangleBTCUSDTL1(shared_orderbook)
+    assert shared_triangle.capture().forward_net(10000) == pytest.approx(
+        local_triangle.forward_net(10000)
+    )
+
+    shared_orderbook.invalidate(USDTCAD_ID)
+    assert not reader.is_valid((USDTCAD_ID,))
+    assert reader[USDTCAD_ID].get_asks() == ()
+
+    reader.close()
+
+
+def test_read_gives_up_on_a_slot_left_mid_publish(shared_orderbook):
+    reader = SharedOrderBookReader(
+        shared_orderbook.name, (BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID)
+    )
+    # A writer that died while publishing leaves the sequence odd
+    reader.ints[reader.slot_offsets[BTCCAD_ID]] += 1
+
+    with pytest.raises(SeqlockTimeout):
+        reader.read(BTCCAD_ID)
+    assert reader[BTCUSDT_ID].get_asks() == ()
+
+    reader.close()
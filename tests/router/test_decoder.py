@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from hermes.router.decoder import NDAXDecoder
+
+
+def frame(message_fn, payload, message_type=3, sequence=2):
+    return json.dumps(
+        {"m": message_type, "i": sequence, "n": message_fn, "o": json.dumps(payload)}
+    )
+
+
+@pytest.fixture
+def decoder():
+    return NDAXDecoder(frozenset(["Level2UpdateEvent"]))
+
+
+def test_wanted_message_is_fully_parsed(decoder):
+    rows = [[1, 0, 0, 0, 0.0, 0, 10.5, 1, 2.0, 1]]
+    message = decoder.decode(frame("Level2UpdateEvent", rows))
+
+    assert message.message_fn == "Level2UpdateEvent"
+    assert message.payload == rows
+    assert message.message["i"] == 2
+
+
+def test_bytes_frames_decode_like_text(decoder):
+    rows = [[1, 0, 0, 0, 0.0, 0, 10.5, 1, 2.0, 1]]
+    message = decoder.decode(frame("Level2UpdateEvent", rows).encode())
+    assert (message.message_fn, message.payload) == ("Level2UpdateEvent", rows)
+
+    skipped = decoder.decode(b'{"m":3,"i":4,"n":"PendingDepositUpdate","o":"x"}')
+    assert (skipped.message_fn, skipped.payload) == ("PendingDepositUpdate", None)
+
+
+def test_unwanted_message_payload_is_skipped(decoder):
+    raw = '{"m":3,"i":4,"n":"PendingDepositUpdate","o":"not json"}'
+    message = decoder.decode(raw)
+
+    assert message.message_fn == "PendingDepositUpdate"
+    assert message.payload is None
+
+
+def test_unusual_key_order_falls_back_to_full_parse(decoder):
+    raw = json.dumps({"n": "Level2UpdateEvent", "o": "[]", "m": 3, "i": 2})
+
+    assert decoder.decode(raw).payload == []
+
+
+def test_malformed_wanted_message_raises(decoder):
+    with pytest.raises(ValueError):
+        decoder.decode('{"m":3,"i":2,"n":"Level2UpdateEvent","o":"[1,"}')
+
+
+def test_awaited_reply_is_parsed_without_a_handler():
+    pending = {6: None}
+    decoder = NDAXDecoder(frozenset(), pending)
+
+    reply = decoder.decode(frame("GetAccountPositions", [], message_type=1, sequence=6))
+    assert (reply.message_type, reply.sequence, reply.payload) == (1, 6, [])
+
+    # Same sequence number on an event is not a reply
+    event = decoder.decode(frame("GetAccountPositions", [], message_type=3, sequence=6))
+    assert event.payload is None
@@ -0,0 +1,130 @@
+import asyncio
+import json
+
+from hermes.exchanges.kraken import KrakenOrderBook, INSTRUMENT_SPECS
+from hermes.orderbook.orderbook import NDAXOrderbook
+from hermes.router.router import KrakenRouter, NDAXRouter
+from hermes.utils.synchronization import SingletonResetEvent
+
+
+def test_handlers_run_in_registration_order_with_stats():
+    router = KrakenRouter(None, None, None, None)
+    calls = []
+
+    async def first(payload):
+        calls.append(("first", payload["event"]))
+
+    async def second(payload):
+        calls.append(("second", payload["event"]))
+
+    router.register("heartbeat", first)
+    router.register("heartbeat", second)
+
+    asyncio.run(router.route(json.dumps({"event": "heartbeat"})))
+    asyncio.run(router.route(json.dumps({"event": "systemStatus"})))
+
+    assert calls == [("first", "heartbeat"), ("second", "heartbeat")]
+    assert router.handler_stats["heartbeat"].calls == 1
+    assert "systemStatus" not in router.handler_stats
+
+
+def test_kraken_book_messages_reach_orderbook():
+    orderbook = KrakenOrderBook(
+        instrument_keys=["XBT/CAD"], depth=5, instrument_specs=INSTRUMENT_SPECS
+    )
+    router = KrakenRouter(None, None, orderbook, None)
+
+    snapshot = [
+        336,
+        {
+            "as": [["68971.7", "0.04400000", "1616663113.1"]],
+            "bs": [["68910.0", "0.15759000", "1616663113.2"]],
+        },
+        "book-10",
+        "XBT/CAD",
+    ]
+    update = [336, {"a": [["68971.7", "0.00000000", "1616663114.1"]]}, "book-10", "XBT/CAD"]
+
+    asyncio.run(router.route(json.dumps(snapshot)))
+    assert orderbook["XBT/CAD"].get_asks() == [(68971.7, 0.044)]
+
+    asyncio.run(router.route(json.dumps(update)))
+    assert orderbook["XBT/CAD"].get_asks() == []
+    assert router.handler_stats["book"].calls == 2
+
+
+def test_deferred_handlers_run_once_per_batch():
+    router = KrakenRouter(None, None, None, None)
+    calls = []
+
+    async def apply(payload):
+        calls.append(("apply", payload["n"]))
+
+    async def evaluate(payload):
+        calls.append(("evaluate", payload["n"]))
+
+    router.register("update", evaluate, deferred=True)
+    router.register("update", apply)
+
+    batch = [json.dumps({"event": "update", "n": n}) for n in range(3)]
+    asyncio.run(router.route_batch(batch))
+
+    assert calls == [("apply", 0), ("apply", 1), ("apply", 2), ("evaluate", 2)]
+    assert router.handler_stats["update"].calls == 3
+    assert router.handler_stats["update:deferred"].calls == 1
+
+
+def test_deferred_only_function_is_not_unhandled():
+    router = KrakenRouter(None, None, None, None)
+    unhandled = []
+    router.handle_unregistered = unhandled.append
+    calls = []
+
+    async def evaluate(payload):
+        calls.append(payload["n"])
+
+    router.register("update", evaluate, deferred=True)
+    asyncio.run(router.route(json.dumps({"event": "update", "n": 1})))
+
+    assert calls == [1]
+    assert unhandled == []
+    assert "update" not in router.handler_stats
+
+
+class SnapshotSession:
+    """Never answers the first SubscribeLevel2, answers the next with no rows."""
+
+    def __init__(self):
+        self.pending_requests = {}
+        self.requests = []
+
+    async def send_market_data(self, message, priority=None):
+        pass
+
+    async def request(self, fn, payload, **kwargs):
+        self.requests.append((fn, payload["InstrumentId"]))
+        if len(self.requests) == 1:
+            raise asyncio.TimeoutError()
+        return []
+
+
+class Unrouted:
+    def register_handlers(self, router):
+        pass
+
+
+def test_resync_retries_lost_snapshot_and_accepts_empty_one(monkeypatch):
+    monkeypatch.setattr(SingletonResetEvent, "_instance", asyncio.Event())
+    orderbook = NDAXOrderbook(instrument_keys=(1, 2), depth=3, backend="array")
+    orderbook.invalidate(2)
+    session = SnapshotSession()
+    router = NDAXRouter(session, Unrouted(), orderbook, Unrouted())
+
+    async def scenario():
+        await router.resync_invalid_books(None)
+        while router.resubscriptions:
+            await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert session.requests == [("SubscribeLevel2", 2), ("SubscribeLevel2", 2)]
+    assert orderbook.is_valid((1, 2))
@@ -0,0 +1,43 @@
+import pytest
+
+from hermes.orderbook.orderbook import ASK, BID, MultiOrderBook
+from hermes.strategies.arbitrage.cross import CrossVenueArbitrage
+from hermes.strategies.arbitrage.triangle import SIDE_BUY, SIDE_SELL
+
+
+@pytest.fixture
+def books():
+    ndax = MultiOrderBook(instrument_keys=(1,), depth=3)
+    kraken = MultiOrderBook(instrument_keys=("XBT/CAD",), depth=3)
+    ndax.apply_batch({(1, ASK): {100.0: 2.0}, (1, BID): {99.0: 2.0}})
+    kraken.apply_batch({("XBT/CAD", ASK): {102.0: 1.0}, ("XBT/CAD", BID): {101.5: 0.5}})
+    return {"ndax": ndax, "kraken": kraken}
+
+
+@pytest.fixture
+def strategy(books):
+    return CrossVenueArbitrage(
+        books, {"ndax": 1, "kraken": "XBT/CAD"}, {"ndax": 0.002, "kraken": 0.0026}
+    )
+
+
+def test_edge_is_net_of_both_fees(strategy):
+    edge = strategy.best_edge()
+
+    assert (edge.buy_venue, edge.sell_venue) == ("ndax", "kraken")
+    assert edge.edge == pytest.approx(101.5 * 0.9974 / (100.0 * 1.002) - 1)
+    assert strategy.net(1000) == pytest.approx(0.5 * (101.5 * 0.9974 - 100.0 * 1.002))
+
+    buy, sell = strategy.get_orders(1000)
+    assert (buy.venue, buy.side, buy.quantity) == ("ndax", SIDE_BUY, 0.5)
+    assert (sell.venue, sell.side, sell.instrument_id) == ("kraken", SIDE_SELL, "XBT/CAD")
+
+
+def test_stale_or_invalid_venues_are_ignored(books, strategy):
+    updated = books["kraken"].last_update_time["XBT/CAD"]
+
+    assert strategy.best_edge(now=updated + 1.0) is not None
+    assert strategy.best_edge(now=updated + 5.0) is None
+
+    books["ndax"].invalidate(1)
+    assert strategy.best_edge() is None
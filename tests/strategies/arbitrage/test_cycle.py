@@ -0,0 +1,85 @@
+import pytest
+
+from hermes.exchanges.ndax import BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID
+from hermes.orderbook.orderbook import BID, MultiOrderBook, OrderBook
+from hermes.strategies.arbitrage.cycle import CycleArbitrage
+from hermes.strategies.arbitrage.triangle import TriangleBTCUSDTL1
+
+NDAX_ASSETS = {
+    BTCCAD_ID: ("BTC", "CAD"),
+    BTCUSDT_ID: ("BTC", "USDT"),
+    USDTCAD_ID: ("USDT", "CAD"),
+}
+
+
+def book(ask, bid):
+    book = OrderBook(depth=1)
+    book.ask[ask[0]] = ask[1]
+    book.bid[bid[0]] = bid[1]
+    return book
+
+
+@pytest.fixture
+def orderbook():
+    orderbook = MultiOrderBook(depth=1)
+    orderbook[BTCCAD_ID] = book((68971.67, 0.044), (68910, 0.15759))
+    orderbook[BTCUSDT_ID] = book((57049.62, 0.053027), (56538.5, 0.15759))
+    orderbook[USDTCAD_ID] = book((1.4, 1234.16), (1.3, 34.96))
+    return orderbook
+
+
+def test_matches_fixed_triangle(orderbook):
+    cycles = CycleArbitrage(orderbook, NDAX_ASSETS, "CAD").capture()
+    triangle = TriangleBTCUSDTL1(orderbook)
+
+    assert cycles.forward() == pytest.approx(triangle.forward())
+    assert cycles.forward_net(300) == pytest.approx(triangle.forward_net(300))
+
+    expected = triangle.get_forward_orders(300)
+    orders = cycles.get_forward_orders(300)
+    assert [(o.instrument_id, o.side) for o in orders] == [
+        (o.instrument_id, o.side) for o in expected
+    ]
+    for order, expected_order in zip(orders, expected):
+        assert order.quantity == pytest.approx(expected_order.quantity)
+    assert cycles.backward_net(300) < 0
+
+
+def test_only_moved_instruments_are_refreshed(orderbook):
+    cycles = CycleArbitrage(orderbook, NDAX_ASSETS, "CAD")
+    assert cycles.refresh() == 3
+    assert cycles.refresh() == 0
+
+    orderbook[USDTCAD_ID] = book((1.2343, 1234.16), (1.2166, 34.96))
+    assert cycles.refresh() == 1
+    # No longer profitable in either direction
+    assert cycles.capture().forward() < 1
+
+
+def test_values_a_snapshot(orderbook):
+    cycles = CycleArbitrage(orderbook, NDAX_ASSETS, "CAD")
+    expected = TriangleBTCUSDTL1(orderbook).forward_net(300)
+
+    snapshot_cycles = cycles.on(orderbook.capture(cycles.instrument_ids))
+    orderbook.apply_batch({(USDTCAD_ID, BID): {1.35: 10.0}})
+
+    assert snapshot_cycles.forward_net(300) == pytest.approx(expected)
+    assert cycles.capture().forward_net(300) != pytest.approx(expected)
+
+
+def test_finds_four_leg_cycles():
+    assets = {1: ("A", "CAD"), 2: ("A", "B"), 3: ("B", "C"), 4: ("C", "CAD")}
+    orderbook = MultiOrderBook(depth=1)
+    orderbook[1] = book((10.0, 100), (9.9, 100))
+    orderbook[2] = book((2.1, 100), (2.0, 100))
+    orderbook[3] = book((2.1, 100), (2.0, 100))
+    orderbook[4] = book((3.1, 100), (3.0, 100))
+
+    cycles = CycleArbitrage(orderbook, assets, "CAD", fee=0.0).capture()
+    orders = cycles.get_forward_orders(10)
+
+    # CAD -> A -> B -> C -> CAD: 1 / 10 * 2 * 2 * 3 = 1.2
+    assert cycles.forward() == pytest.approx(1.2)
+    assert [o.instrument_id for o in orders] == [1, 2, 3, 4]
+    assert [o.quantity for o in orders] == pytest.approx([1.0, 1.0, 2.0, 4.0])
+    assert cycles.forward_net(10) == pytest.approx(2.0)
@@ -0,0 +1,40 @@
+from hermes.exchanges.kraken import INSTRUMENT_ASSETS
+from hermes.orderbook.orderbook import MultiOrderBook
+from hermes.strategies.arbitrage.discovery import TriangleIndex, find_cycles
+from hermes.strategies.arbitrage.triangle import SIDE_BUY, SIDE_SELL
+
+
+def test_finds_every_triangular_cycle():
+    cycles = find_cycles(INSTRUMENT_ASSETS)
+
+    assert [assets for assets, _ in cycles] == [
+        ("CAD", "ETH", "XBT"),
+        ("CAD", "ETH", "XRP"),
+        ("CAD", "XBT", "XRP"),
+        ("ETH", "XBT", "XRP"),
+    ]
+
+
+def test_discover_orients_triangles_through_cash():
+    orderbook = MultiOrderBook(instrument_keys=INSTRUMENT_ASSETS, depth=1)
+    index = TriangleIndex.discover(orderbook, INSTRUMENT_ASSETS, "CAD")
+
+    assert sorted(triangle.instrument_ids for triangle in index) == [
+        ("ETH/CAD", "ETH/XBT", "XBT/CAD"),
+        ("XRP/CAD", "XRP/ETH", "ETH/CAD"),
+        ("XRP/CAD", "XRP/XBT", "XBT/CAD"),
+    ]
+    assert len(index.affected({"ETH/XBT"})) == 1
+    assert len(index.affected({"XBT/CAD", "ETH/CAD"})) == 3
+    assert index.affected({"BTC/USD"}) == []
+
+
+def test_discover_handles_cash_as_base():
+    assets = {1: ("BTC", "CAD"), 2: ("BTC", "USDT"), 3: ("CAD", "USDT")}
+    (triangle,) = TriangleIndex.discover(
+        MultiOrderBook((1, 2, 3), depth=1), assets, "CAD"
+    )
+
+    # CAD -> BTC -> USDT -> CAD: buy BTC/CAD, sell BTC/USDT, buy CAD/USDT
+    assert triangle.instrument_ids == (1, 2, 3)
+    assert triangle.sides == (SIDE_BUY, SIDE_SELL, SIDE_BUY)
@@ -1,12 +1,17 @@
+import random
+
 import pytest
 
 from hermes.strategies.arbitrage.triangle import (
     TriangleBTCUSDTL1,
+    TriangleBSSL2,
+    TriangleBBS,
+    TriangleEngine,
     SIDE_BUY,
     SIDE_SELL,
     ORDER_TYPE_MARKET,
 )
-from hermes.orderbook.orderbook import MultiOrderBook, OrderBook
+from hermes.orderbook.orderbook import ASK, BID, MultiOrderBook, OrderBook
 from hermes.exchanges.ndax import BTCCAD_ID, BTCUSDT_ID, USDTCAD_ID
 from hermes.utils.structures import Order
 
@@ -268,5 +273,175 @@ class Test_MarketTriangleL1:
         assert o3.quantity == pytest.approx(true_order_3.quantity, abs=1e-5)
         assert o3.order_type == true_order_3.order_type
 
+    def test_snapshot_capture_is_consistent(self, orderbook_2):
+        cash_available = 10000
+        triangle = TriangleBTCUSDTL1(orderbook_2, fee=0.002)
+        captured = triangle.capture()
+
+        forward_net = triangle.forward_net(cash_available)
+
+        # Later book updates don't leak into the captured view
+        orderbook_2[USDTCAD_ID].bid[1.35] = 10.0
+
+        assert captured.forward_net(cash_available) == pytest.approx(forward_net)
+        assert captured.get_forward_orders(cash_available)[2].quantity == pytest.approx(
+            34.96, abs=1e-5
+        )
+        assert triangle.forward_net(cash_available) != pytest.approx(forward_net)
+
+
+@pytest.fixture
+def ladder_orderbook():
+    orderbook = MultiOrderBook(depth=3)
+
+    x_cad = OrderBook(depth=3)
+    x_y = OrderBook(depth=3)
+    y_cad = OrderBook(depth=3)
+    for price in (100.0, 101.0, 103.0):
+        x_cad.ask[price] = 1.0
+    x_cad.bid[99.0] = 5.0
+    x_y.bid[2.0] = 10.0
+    x_y.ask[2.1] = 10.0
+    y_cad.bid[51.0] = 100.0
+    y_cad.ask[52.0] = 100.0
+
+    orderbook[1] = x_cad
+    orderbook[2] = x_y
+    orderbook[3] = y_cad
+    return orderbook
+
+
+class Test_MarketTriangleL2:
+    def test_matches_l1_on_single_level_books(self, orderbook_2):
+        l1 = TriangleBTCUSDTL1(orderbook_2)
+        l2 = TriangleBSSL2(orderbook_2).capture()
+
+        assert l2.forward_net(10000) == pytest.approx(l1.forward_net(10000))
+        for order, expected in zip(
+            l2.get_forward_orders(10000), l1.get_forward_orders(10000)
+        ):
+            assert order.quantity == pytest.approx(expected.quantity)
+            assert order.expected_price == pytest.approx(expected.expected_price)
+
+    def test_walks_levels_while_profitable(self, ladder_orderbook):
+        triangle = TriangleBSSL2(ladder_orderbook, instrument_ids=(1, 2, 3), fee=0.0)
+
+        # 102 per X: the 100 and 101 asks are profitable, the 103 ask is not
+        assert triangle.forward_net(10000) == pytest.approx(3.0)
+        o1, o2, o3 = triangle.get_forward_orders(10000)
+        assert (o1.side, o2.side, o3.side) == (SIDE_BUY, SIDE_SELL, SIDE_SELL)
+        assert o1.quantity == pytest.approx(2.0)
+        assert o1.expected_price == pytest.approx(100.5)
+        assert o2.quantity == pytest.approx(2.0)
+        assert o3.quantity == pytest.approx(4.0)
+
+    def test_cash_limits_the_walk(self, ladder_orderbook):
+        triangle = TriangleBSSL2(ladder_orderbook, instrument_ids=(1, 2, 3), fee=0.0)
 
+        bought = 1.0 + 50.0 / 101.0
+        assert triangle.forward_net(150) == pytest.approx(bought * 102.0 - 150)
+        assert triangle.get_forward_orders(150)[0].quantity == pytest.approx(bought)
 
+    def test_live_instance_sees_depth_changes(self, ladder_orderbook):
+        triangle = TriangleBSSL2(ladder_orderbook, instrument_ids=(1, 2, 3), fee=0.0)
+        captured = triangle.capture()
+        assert triangle.forward_net(10000) == pytest.approx(3.0)
+
+        # Below L1, so the top of book and its counter don't move
+        ladder_orderbook.apply_batch({(1, ASK): {101.0: 0.0, 100.5: 1.0}})
+
+        assert triangle.forward_net(10000) == pytest.approx(3.5)
+        assert captured.forward_net(10000) == pytest.approx(3.0)
+
+    def test_unprofitable_direction_does_not_trade(self, ladder_orderbook):
+        triangle = TriangleBSSL2(ladder_orderbook, instrument_ids=(1, 2, 3))
+
+        assert triangle.backward_net(10000) == 0.0
+        assert triangle.get_backward_orders(10000) is None
+
+
+def test_l1_is_read_once_per_capture(orderbook_2):
+    triangle = TriangleBTCUSDTL1(orderbook_2)
+    captured = triangle.capture()
+    l1 = captured.l1()
+
+    captured.forward_net(10000)
+    captured.get_forward_orders(10000)
+    assert captured.l1() is l1
+
+    # The live triangle reads the book on every call
+    orderbook_2[USDTCAD_ID].bid[1.35] = 10.0
+    assert triangle.l1()[10:] == (1.35, 10.0)
+
+
+def test_empty_side_only_blocks_the_direction_using_it(orderbook_2):
+    triangle = TriangleBTCUSDTL1(orderbook_2)
+    forward_net = triangle.forward_net(10000)
+
+    # Only the backward cycle buys USDTCAD
+    orderbook_2.apply_batch({(USDTCAD_ID, ASK): {1.4: 0.0}})
+
+    assert triangle.forward_net(10000) == pytest.approx(forward_net)
+    assert triangle.get_forward_orders(10000) is not None
+    assert not triangle.backward_net(10000) > 0
+    assert triangle.get_backward_orders(10000) is None
+
+
+def test_bbs_forward_is_bss_backward(orderbook_2):
+    bss = TriangleBTCUSDTL1(orderbook_2)
+    bbs = TriangleBBS(orderbook_2, instrument_ids=[USDTCAD_ID, BTCUSDT_ID, BTCCAD_ID])
+
+    assert bbs.forward() == pytest.approx(bss.backward())
+    assert bbs.forward_net(10000) == pytest.approx(bss.backward_net(10000))
+    assert bbs.backward_net(10000) == pytest.approx(bss.forward_net(10000))
+    for order, expected in zip(
+        bbs.get_forward_orders(10000), bss.get_backward_orders(10000)
+    ):
+        assert (order.instrument_id, order.side) == (expected.instrument_id, expected.side)
+        assert order.quantity == pytest.approx(expected.quantity)
+
+
+def test_engine_sells_into_cash_base_pair():
+    orderbook = MultiOrderBook(depth=1)
+    for _id, (ask, bid) in {1: (10.0, 9.0), 2: (2.0, 1.9), 3: (0.6, 0.5)}.items():
+        book = OrderBook(depth=1)
+        book.ask[ask] = 100.0
+        book.bid[bid] = 100.0
+        orderbook[_id] = book
+
+    # CAD -> A on A/CAD, A -> B on A/B, B -> CAD on CAD/B (buying CAD with B)
+    triangle = TriangleEngine(
+        orderbook, instrument_ids=[1, 2, 3], fee=0.0, sides=(SIDE_BUY, SIDE_SELL, SIDE_BUY)
+    )
+
+    assert triangle.forward() == pytest.approx(1 / 10.0 * 1.9 / 0.6)
+    o1, o2, o3 = triangle.get_forward_orders(10)
+    assert (o1.quantity, o2.quantity) == pytest.approx((1.0, 1.0))
+    assert o3.quantity == pytest.approx(1.9 / 0.6)
+
+
+def test_triggers_match_full_evaluation(orderbook_1):
+    triangle = TriangleBTCUSDTL1(orderbook_1)
+    assert not triangle.crossed(triangle.instrument_ids)
+
+    # Move one side at a time around the original quotes, both directions
+    # become profitable now and then
+    rng = random.Random(7)
+    outcomes = set()
+    mids = {BTCCAD_ID: 68940.0, BTCUSDT_ID: 56800.0, USDTCAD_ID: 1.22}
+    for _ in range(300):
+        _id = rng.choice(triangle.instrument_ids)
+        book = orderbook_1[_id]
+        mid = mids[_id] * rng.uniform(0.97, 1.03)
+        spread = mids[_id] * 0.002
+        groups = {
+            (_id, ASK): {book.best_ask_price(): 0.0, round(mid + spread, 6): 1.0},
+            (_id, BID): {book.best_bid_price(): 0.0, round(mid - spread, 6): 1.0},
+        }
+        changed = orderbook_1.apply_batch(groups)
+
+        expected = triangle.forward() > 1 or triangle.backward() > 1
+        assert triangle.crossed(changed) == expected
+        outcomes.add(expected)
+
+    assert outcomes == {True, False}
@@ -0,0 +1,60 @@
+from hermes.trader.orders import (
+    OrderStore,
+    ORDER_PENDING,
+    ORDER_ACKED,
+    ORDER_PARTIALLY_FILLED,
+    ORDER_FILLED,
+    ORDER_CANCELLED,
+)
+from hermes.utils.structures import Order
+
+
+def make_order(quantity=1.0):
+    return Order(instrument_id=1, side=0, quantity=quantity, order_type=1)
+
+
+def test_lifecycle_retires_completed_execution():
+    store = OrderStore()
+    execution = store.new_execution()
+    for client_id in (1, 2, 3):
+        store.add(client_id, execution, make_order())
+    assert store.get(2).state == ORDER_PENDING
+
+    store.set_state(2, ORDER_ACKED)
+    assert store.fill(2, 0.4).state == ORDER_PARTIALLY_FILLED
+    assert store.fill(2, 0.6).filled_quantity == 1.0
+
+    store.set_state(1, ORDER_FILLED)
+    store.set_state(2, ORDER_FILLED)
+    assert not store.is_complete(execution)
+
+    store.set_state(3, ORDER_CANCELLED)
+    assert store.is_complete(execution)
+    assert len(store) == 0
+
+    # Retired records still answer late events
+    assert store.get(3).state == ORDER_CANCELLED
+    assert store.fill(1, 0.1).state == ORDER_FILLED
+
+
+def test_history_is_bounded():
+    store = OrderStore(history=2)
+    for client_id in range(5):
+        execution = store.new_execution()
+        store.add(client_id, execution, make_order())
+        store.set_state(client_id, ORDER_FILLED)
+
+    assert [execution_id for execution_id, _ in store.history] == [4, 5]
+    assert sorted(store.retired) == [3, 4]
+    assert store.get(0) is None
+    assert store.set_state(4, ORDER_CANCELLED) is None  # No longer live
+
+
+def test_clear_drops_live_orders():
+    store = OrderStore()
+    execution = store.new_execution()
+    store.add(1, execution, make_order())
+    store.clear()
+
+    assert store.get(1) is None
+    assert store.set_state(1, ORDER_FILLED) is None
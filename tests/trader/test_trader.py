@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import pytest
+
+from hermes.trader.orders import ORDER_FILLED, ORDER_PENDING
+from hermes.trader.trader import NDAXMarketTriangleTrader
+from hermes.utils.structures import Order
+from hermes.utils.synchronization import SingletonTradeLock, SingletonResetEvent
+
+
+class RecordingSession:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, request, priority=None):
+        self.sent.append(json.loads(json.loads(request)["o"])["ClientOrderId"])
+
+
+def trade_event(client_id, order):
+    return {
+        "ClientOrderId": client_id,
+        "Quantity": order.quantity,
+        "Price": order.expected_price,
+        "Side": "Buy" if order.side == 0 else "Sell",
+        "InstrumentId": order.instrument_id,
+        "Value": order.quantity * order.expected_price,
+    }
+
+
+def state_event(client_id, state):
+    return {"ClientOrderId": client_id, "OrderState": state}
+
+
+@pytest.fixture
+def trader(monkeypatch):
+    monkeypatch.setattr(SingletonTradeLock, "_instance", asyncio.Lock())
+    monkeypatch.setattr(SingletonResetEvent, "_instance", asyncio.Event())
+    return NDAXMarketTriangleTrader(
+        RecordingSession(), None, account_id=1, triangle=None, cash_available=100,
+        sequential=True,
+    )
+
+
+def test_sequential_legs_hold_the_lock_until_all_fill(trader):
+    orders = [
+        Order(instrument_id=_id, side=side, quantity=1.0, order_type=1, expected_price=1.0)
+        for _id, side in ((1, 0), (82, 1), (80, 1))
+    ]
+
+    async def scenario():
+        await trader.process_orders(orders)
+        first, second, third = trader.orders.orders
+        assert trader.session.sent == [first]
+        assert trader.orders.get(third).state == ORDER_PENDING
+
+        # State before trade: the unsent legs keep the execution open
+        await trader.handle_state_change_event(state_event(first, "FullyExecuted"))
+        assert trader.trade_lock.locked()
+        await trader.handle_trade_event(trade_event(first, orders[0]))
+        await trader.handle_trade_event(trade_event(first, orders[0]))  # Second fill
+        assert trader.session.sent == [first, second]
+
+        await trader.handle_trade_event(trade_event(second, orders[1]))
+        await trader.handle_state_change_event(state_event(second, "FullyExecuted"))
+        assert trader.session.sent == [first, second, third]
+        assert trader.trade_lock.locked()
+
+        await trader.handle_trade_event(trade_event(third, orders[2]))
+        await trader.handle_state_change_event(state_event(third, "FullyExecuted"))
+        assert not trader.trade_lock.locked()
+        assert len(trader.orders) == 0
+        assert trader.orders.get(third).state == ORDER_FILLED
+
+    asyncio.run(scenario())
+
+
+def test_cancel_of_unknown_order_releases_the_lock(trader):
+    async def scenario():
+        await trader.trade_lock.acquire()
+        await trader.handle_state_change_event(state_event(999, "Cancelled"))
+        assert not trader.trade_lock.locked()
+        assert trader.reset_trigger.is_set()
+
+    asyncio.run(scenario())
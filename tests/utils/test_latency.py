@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from hermes.utils.latency import LatencyHistogram, LatencyTracer, STAGE_PARSE
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram()
+    for value in range(1, 11):
+        histogram.record(value)
+
+    assert histogram.percentile(50) == 5
+    assert histogram.percentile(100) == 10
+    assert histogram.mean == 5.5
+
+
+def test_percentiles_within_bucket_precision():
+    rng = random.Random(3)
+    values = sorted(rng.randint(1_000, 50_000_000) for _ in range(10_000))
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+
+    for percentile in (50, 90, 99, 99.9):
+        exact = values[round(len(values) * percentile / 100) - 1]
+        assert histogram.percentile(percentile) == pytest.approx(exact, rel=0.07)
+    assert histogram.percentile(100) == values[-1]
+
+
+def test_tracer_is_disabled_by_default():
+    tracer = LatencyTracer()
+    assert not tracer.enabled
+
+    tracer.record(STAGE_PARSE, 0)
+    assert tracer.histograms[STAGE_PARSE].count == 1
+    tracer.reset()
+    assert tracer.histograms[STAGE_PARSE].count == 0
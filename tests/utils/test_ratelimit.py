@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from hermes.utils.ratelimit import (
+    SlidingWindowRateLimiter,
+    PRIORITY_ORDER,
+    PRIORITY_SUBSCRIPTION,
+    PRIORITY_ACCOUNT,
+)
+
+
+def test_reserved_slots_are_kept_for_orders():
+    limiter = SlidingWindowRateLimiter(3, window=60, reserved=1)
+
+    assert limiter.try_acquire(PRIORITY_SUBSCRIPTION)
+    assert limiter.try_acquire(PRIORITY_ACCOUNT)
+    assert not limiter.try_acquire(PRIORITY_ACCOUNT)
+    assert limiter.try_acquire(PRIORITY_ORDER)
+    assert not limiter.try_acquire(PRIORITY_ORDER)
+    assert limiter.available() == 0
+
+
+def test_waiters_are_released_by_priority():
+    async def scenario():
+        limiter = SlidingWindowRateLimiter(2, window=0.05)
+        assert limiter.try_acquire(PRIORITY_ORDER)
+        assert limiter.try_acquire(PRIORITY_ORDER)
+
+        released = []
+
+        async def wait(name, priority):
+            await limiter.acquire(priority)
+            released.append(name)
+
+        await asyncio.gather(
+            wait("account", PRIORITY_ACCOUNT),
+            wait("subscription", PRIORITY_SUBSCRIPTION),
+            wait("order", PRIORITY_ORDER),
+        )
+        return released
+
+    assert asyncio.run(scenario()) == ["order", "subscription", "account"]
+
+
+def test_reserved_must_leave_room():
+    with pytest.raises(ValueError):
+        SlidingWindowRateLimiter(5, reserved=5)